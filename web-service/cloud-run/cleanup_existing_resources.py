@@ -4,17 +4,16 @@ Script to clean up existing Anava resources before deployment.
 This handles the case where resources already exist and would cause conflicts.
 """
 
+import shlex
 import subprocess
 import sys
-import json
 import os
 
 def run_gcloud_command(command):
-    """Run a gcloud command and return the result."""
+    """Run a gcloud command (an argv list, no shell) and return the result."""
     try:
         result = subprocess.run(
             command,
-            shell=True,
             capture_output=True,
             text=True,
             check=False
@@ -33,38 +32,41 @@ def cleanup_resources(project_id, solution_prefix="anava"):
         {
             "name": "Service Accounts",
             "commands": [
-                f"gcloud iam service-accounts delete {solution_prefix}-device-auth-sa@{project_id}.iam.gserviceaccount.com --project={project_id} --quiet",
-                f"gcloud iam service-accounts delete {solution_prefix}-tvm-sa@{project_id}.iam.gserviceaccount.com --project={project_id} --quiet",
-                f"gcloud iam service-accounts delete {solution_prefix}-vertex-ai-sa@{project_id}.iam.gserviceaccount.com --project={project_id} --quiet",
-                f"gcloud iam service-accounts delete {solution_prefix}-apigw-invoker-sa@{project_id}.iam.gserviceaccount.com --project={project_id} --quiet"
+                ["gcloud", "iam", "service-accounts", "delete", f"{solution_prefix}-device-auth-sa@{project_id}.iam.gserviceaccount.com", f"--project={project_id}", "--quiet"],
+                ["gcloud", "iam", "service-accounts", "delete", f"{solution_prefix}-tvm-sa@{project_id}.iam.gserviceaccount.com", f"--project={project_id}", "--quiet"],
+                ["gcloud", "iam", "service-accounts", "delete", f"{solution_prefix}-vertex-ai-sa@{project_id}.iam.gserviceaccount.com", f"--project={project_id}", "--quiet"],
+                ["gcloud", "iam", "service-accounts", "delete", f"{solution_prefix}-apigw-invoker-sa@{project_id}.iam.gserviceaccount.com", f"--project={project_id}", "--quiet"]
             ]
         },
         {
             "name": "Cloud Functions",
             "commands": [
-                f"gcloud functions delete {solution_prefix}-device-auth-fn --region=us-central1 --project={project_id} --quiet",
-                f"gcloud functions delete {solution_prefix}-tvm-fn --region=us-central1 --project={project_id} --quiet"
+                ["gcloud", "functions", "delete", f"{solution_prefix}-device-auth-fn", "--region=us-central1", f"--project={project_id}", "--quiet"],
+                ["gcloud", "functions", "delete", f"{solution_prefix}-tvm-fn", "--region=us-central1", f"--project={project_id}", "--quiet"]
             ]
         },
         {
             "name": "API Gateway",
             "commands": [
-                f"gcloud api-gateway gateways delete {solution_prefix}-gateway --location=us-central1 --project={project_id} --quiet",
-                f"gcloud api-gateway api-configs delete {solution_prefix}-config --api={solution_prefix}-api --project={project_id} --quiet",
-                f"gcloud api-gateway apis delete {solution_prefix}-api --project={project_id} --quiet"
+                ["gcloud", "api-gateway", "gateways", "delete", f"{solution_prefix}-gateway", "--location=us-central1", f"--project={project_id}", "--quiet"],
+                ["gcloud", "api-gateway", "api-configs", "delete", f"{solution_prefix}-config", f"--api={solution_prefix}-api", f"--project={project_id}", "--quiet"],
+                ["gcloud", "api-gateway", "apis", "delete", f"{solution_prefix}-api", f"--project={project_id}", "--quiet"]
             ]
         },
         {
             "name": "Storage Buckets",
+            # Best effort: a missing or non-empty bucket is not an error here
+            "ignore_errors": True,
             "commands": [
-                f"gsutil -m rm -rf gs://{project_id}-{solution_prefix}-functions || true",
-                f"gsutil rb gs://{project_id}-{solution_prefix}-functions || true"
+                ["gsutil", "-m", "rm", "-rf", f"gs://{project_id}-{solution_prefix}-functions"],
+                ["gsutil", "rb", f"gs://{project_id}-{solution_prefix}-functions"]
             ]
         },
         {
             "name": "Firestore Database",
+            "ignore_errors": True,
             "commands": [
-                f"gcloud firestore databases delete --database=(default) --project={project_id} --quiet || true"
+                ["gcloud", "firestore", "databases", "delete", "--database=(default)", f"--project={project_id}", "--quiet"]
             ]
         }
     ]
@@ -76,10 +78,10 @@ def cleanup_resources(project_id, solution_prefix="anava"):
         cleanup_results[resource_group['name']] = []
         
         for command in resource_group['commands']:
-            print(f"  Running: {command}")
+            print(f"  Running: {shlex.join(command)}")
             success, stdout, stderr = run_gcloud_command(command)
             
-            if success:
+            if success or resource_group.get('ignore_errors'):
                 print(f"  ✅ Success")
                 cleanup_results[resource_group['name']].append({"command": command, "success": True})
             else:
@@ -105,7 +107,7 @@ def main():
     solution_prefix = "anava"
     
     # Verify gcloud is authenticated
-    success, stdout, stderr = run_gcloud_command("gcloud auth list --filter=status:ACTIVE --format='value(account)'")
+    success, stdout, stderr = run_gcloud_command(["gcloud", "auth", "list", "--filter=status:ACTIVE", "--format=value(account)"])
     if not success or not stdout:
         print("❌ Error: gcloud is not authenticated. Please run 'gcloud auth login' first.")
         sys.exit(1)
@@ -113,7 +115,7 @@ def main():
     print(f"🔑 Authenticated as: {stdout}")
     
     # Verify project exists and is accessible
-    success, stdout, stderr = run_gcloud_command(f"gcloud projects describe {project_id} --format='value(projectId)'")
+    success, stdout, stderr = run_gcloud_command(["gcloud", "projects", "describe", project_id, "--format=value(projectId)"])
     if not success:
         print(f"❌ Error: Cannot access project {project_id}. Please check the project ID and your permissions.")
         sys.exit(1)
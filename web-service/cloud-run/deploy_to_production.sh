@@ -8,6 +8,17 @@ echo "=============================================="
 PROJECT_ID=$(gcloud config get-value project)
 echo "📋 Project: $PROJECT_ID"
 
+# /api/deployments lists a user's deployments newest first, which needs a
+# composite index; creating one that already exists fails harmlessly
+echo ""
+echo "🗂️  Ensuring Firestore index for deployment history..."
+gcloud firestore indexes composite create \
+  --project="$PROJECT_ID" \
+  --collection-group=deployments \
+  --field-config=field-path=user,order=ascending \
+  --field-config=field-path=createdAt,order=descending \
+  --async 2>/dev/null || echo "ℹ️  Index already exists"
+
 # Deploy the main service
 echo ""
 echo "📦 Deploying anava-deploy service..."
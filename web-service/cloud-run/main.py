@@ -4,29 +4,72 @@ Fixed deployment with CLEAR logging and UI updates
 """
 
 import os
-import json
-import uuid
+import re
+import hashlib
+import hmac
+import logging
+import shutil
+import socket
+import string
 import subprocess
 import tempfile
 import time
-from datetime import datetime
+import threading
+import queue
+import contextlib
+import concurrent.futures
+from collections import deque
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
 from typing import Dict, Any, Optional
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from google.auth.transport import requests
-from google.oauth2 import id_token
+from google.auth import jwt
 from google.cloud import firestore, secretmanager
 import google.auth
 import google.auth.transport.requests
 import google_auth_oauthlib.flow
-from googleapiclient import discovery
+from googleapiclient import discovery, discovery_cache
 import redis
+import redis.backoff
+import redis.retry
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+from ulid import ULID
+from werkzeug.http import http_date
+
+from terraform_retry_handler import TerraformRetryHandler, run_streamed
+
+def _json_default(obj):
+    """Serialize what orjson can't, matching Flask's default JSON provider"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    return str(obj)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify and request.json"""
+    
+    def dumps(self, obj, **kwargs):
+        # Route datetimes through _json_default so responses keep Flask's HTTP-date format
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get('SESSION_SECRET', 'dev-secret-change-in-prod')
 CORS(app, origins=['https://anava.ai', 'http://localhost:5000'])
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('anava.deploy')
+
 # Version info
 VERSION = "2.3.47"  # ADDED: Resilient handling of existing API Gateway resources
 COMMIT_SHA = os.environ.get('COMMIT_SHA', 'dev')
@@ -38,37 +81,510 @@ CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 REDIRECT_URI = os.environ.get('REDIRECT_URI', 'https://anava-deploy-392865621461.us-central1.run.app/callback')
 
+# Terraform provider plugin cache shared by every deployment on this instance.
+# Point TF_PLUGIN_CACHE_DIR at a mounted volume (e.g. GCS FUSE) to share it
+# across Cloud Run instances as well.
+TF_PLUGIN_CACHE_DIR = os.environ.get('TF_PLUGIN_CACHE_DIR', '/tmp/terraform-plugins')
+os.makedirs(TF_PLUGIN_CACHE_DIR, exist_ok=True)
+
+# Root module initialised at image build time (see Dockerfile). Its
+# .terraform directory and lock file are hard-linked into each new working
+# directory in place of running terraform init, which is only needed when
+# the template is missing.
+TF_TEMPLATE_DIR = os.environ.get('TF_TEMPLATE_DIR', '/terraform-cache/tf-template')
+
+# Initialised working directories are kept here and handed to later
+# deployments, which then skip terraform init. Only the deployment-specific
+# files below are removed between uses; .terraform and the lock file stay, as
+# does main.tf, which holds no secrets and is rewritten only when it differs.
+TF_WORKDIR_ROOT = os.environ.get('TF_WORKDIR_ROOT', os.path.join(tempfile.gettempdir(), 'tf-workdirs'))
+TF_WORKDIR_JOB_FILES = ('creds.json', 'terraform.tfstate', 'terraform.tfstate.backup',
+                        '.terraform.tfstate.lock.info', 'tfplan', 'crash.log')
+_IDLE_TF_WORKDIRS = []
+# SHA-256 of the main.tf last written into each working directory
+_TF_WORKDIR_CONFIGS = {}
+_INITIALIZED_TF_WORKDIRS = set()
+_TF_WORKDIR_LOCK = threading.Lock()
+
+# Most of the module's resources are independent API enables, IAM bindings and
+# secrets, so walk the graph wider than terraform's default of 10. 20 parallel
+# writes stays well inside the per-project write quota.
+TF_PARALLELISM = int(os.environ.get('TF_PARALLELISM', 20))
+
+# Shared pool for fanning out independent Google API calls within a request
+API_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+# Deployments run on a fixed pool in this process. A slot is claimed before a
+# job leaves the Redis queue, so when every slot is busy jobs wait in Redis
+# instead of piling up as threads.
+MAX_CONCURRENT_DEPLOYMENTS = int(os.environ.get('MAX_CONCURRENT_DEPLOYMENTS', 4))
+DEPLOYMENT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_DEPLOYMENTS,
+    thread_name_prefix='deployment'
+)
+DEPLOYMENT_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_DEPLOYMENTS)
+
+# Shared session for direct Google REST calls, so TLS connections to
+# *.googleapis.com are reused across calls and deployments. Transient
+# failures are retried here; callers still see the final response.
+GOOGLE_API_SESSION = requests.Session()
+GOOGLE_API_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,
+        raise_on_status=False
+    )
+))
+
+# (connect, read) timeout for a single Google REST call
+GOOGLE_API_TIMEOUT = (5, 25)
+
+# Read-modify-write attempts for the project IAM policy when setIamPolicy
+# hits an etag conflict
+IAM_POLICY_ATTEMPTS = 3
+
+# Time new project IAM grants are given to propagate before Terraform creates
+# the resources that depend on them
+IAM_PROPAGATION_SECONDS = 30
+
+# services:batchEnable takes at most 20 service IDs per call
+SERVICE_USAGE_BATCH_LIMIT = 20
+
+# services:batchGet takes at most 30 names per call
+SERVICE_USAGE_BATCH_GET_LIMIT = 30
+
+# How long to wait for a batchEnable operation before moving on
+SERVICE_USAGE_OPERATION_TIMEOUT = 120
+
+# serviceusage enable calls in flight per deployment; higher just trips the
+# per-project mutate quota
+API_ENABLE_CONCURRENCY = 10
+
+# Root configuration written into each deployment's working directory
+TF_CONFIG_TEMPLATE = string.Template("""
+terraform {
+  required_version = ">= 1.5.0"
+}
+
+module "anava" {
+  source = "/terraform-cache/anava-gcp-module"
+  
+  project_id       = "${project_id}"
+  region          = "${region}"
+  solution_prefix = "${prefix}"
+  storage_location = "${storage_location}"
+}
+
+output "api_gateway_url" {
+  value = module.anava.api_gateway_url
+}
+
+output "api_key" {
+  value = module.anava.api_key
+  sensitive = true
+}
+
+output "firebase_config" {
+  value = module.anava.firebase_config
+  sensitive = true
+}
+
+output "firebase_config_secret_name" {
+  value = module.anava.firebase_config_secret_name
+}
+
+output "firebase_api_key_secret_name" {
+  value = module.anava.firebase_api_key_secret_name
+}
+
+output "workload_identity_provider" {
+  value = module.anava.workload_identity_provider
+}
+
+output "vertex_ai_service_account_email" {
+  value = module.anava.vertex_ai_service_account_email
+}
+
+output "device_auth_function_url" {
+  value = module.anava.device_auth_function_url
+}
+
+output "tvm_function_url" {
+  value = module.anava.tvm_function_url
+}
+
+output "firebase_storage_bucket" {
+  value = module.anava.firebase_storage_bucket
+}
+
+output "firebase_web_app_id" {
+  value = module.anava.firebase_web_app_id
+}
+""")
+
 # Redis for job tracking - with fallback
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
 
-def get_redis_client():
-    """Get Redis client with connection retry"""
+# Enough for every gunicorn thread and deployment, including the blocking
+# XREAD connection each open log stream holds
+REDIS_MAX_CONNECTIONS = 64
+
+# Connection and timeout errors are retried with exponential backoff
+# (0.2s, 0.4s, ... capped at 10s) so a Redis failover or restart is ridden
+# out instead of failing every command issued during it
+REDIS_RETRIES = 5
+
+def get_redis_client(decode_responses=True, socket_timeout=None, max_connections=REDIS_MAX_CONNECTIONS,
+                     retries=REDIS_RETRIES):
+    """Get Redis client with connection retry
+
+    Each client owns a blocking pool: once max_connections are checked out,
+    callers wait for one to come back instead of opening more. Reads have no
+    timeout by default so blocking commands (XREADGROUP, XREAD BLOCK) are
+    never cut short; TCP keepalive and the periodic health check catch dead
+    peers.
+    """
     try:
-        client = redis.StrictRedis(
+        pool = redis.BlockingConnectionPool(
             host=REDIS_HOST,
             port=REDIS_PORT,
-            decode_responses=True,
+            max_connections=max_connections,
+            timeout=5,
+            decode_responses=decode_responses,
             socket_connect_timeout=2,
-            socket_timeout=2,
-            retry_on_timeout=True,
-            retry_on_error=[ConnectionError, TimeoutError],
+            socket_timeout=socket_timeout,
+            socket_keepalive=True,
+            retry=redis.retry.Retry(redis.backoff.ExponentialBackoff(cap=10, base=0.1), retries),
+            retry_on_error=[redis.ConnectionError, redis.TimeoutError],
             health_check_interval=30
         )
+        client = redis.StrictRedis(connection_pool=pool)
         client.ping()
         return client
-    except Exception as e:
-        print(f"Redis connection failed at {REDIS_HOST}:{REDIS_PORT} - Error: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Redis connection failed at %s:%s", REDIS_HOST, REDIS_PORT)
         return None
 
 # Initialize Redis
 redis_client = get_redis_client()
 REDIS_AVAILABLE = redis_client is not None
 
+# /health must answer quickly even when Redis is struggling, so it gets its
+# own small pool with a short read timeout
+redis_health_client = get_redis_client(socket_timeout=1, max_connections=2, retries=1) if REDIS_AVAILABLE else None
+
+# Adding a job to the queue is not idempotent: a retry after a reply was lost
+# would queue the deployment twice and run two applies against one project.
+# Jobs are therefore added through a client that never retries.
+redis_enqueue_client = get_redis_client(max_connections=4, retries=0) if REDIS_AVAILABLE else None
+
+# Load-balancer probes can hit /health several times a second; the Redis
+# probe result is reused for HEALTH_CACHE_SECONDS and refreshed by one caller
+HEALTH_CACHE_SECONDS = 1.0
+_HEALTH_CACHE = {'checked_at': 0.0, 'redis_status': 'unavailable', 'queue_length': -1}
+_HEALTH_LOCK = threading.Lock()
+
 # In-memory fallback for logs when Redis is unavailable
 IN_MEMORY_LOGS = {}
+# Lines trimmed from the front of each in-memory log; ?since= cursors count
+# every line ever logged, so this is subtracted before indexing the list
+IN_MEMORY_LOG_BASE = {}
+
+# Cap on stored log lines per deployment; a full apply stays well below it
+LOG_MAX_ENTRIES = 10000
+
+# Most log entries returned by one ?since= poll
+LOG_PAGE_SIZE = 1000
+
+# Log cursors handed to clients: a Redis stream ID, or a list index for the
+# in-memory fallback
+LOG_CURSOR_RE = re.compile(r'^\d+(?:-\d+)?$')
+
+def deployment_log_key(deployment_id):
+    """Redis stream holding a deployment's log lines, oldest first"""
+    return f'deployment_log_stream:{deployment_id}'
+
+# Log streams hold a gunicorn thread each, so they are closed periodically
+# (EventSource reconnects on its own) and kept alive with comment frames.
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_SECONDS = 300
+# Each open stream ties up one of gunicorn's 32 threads, so only this many
+# run at once; beyond that the stream is refused with a 503 and the
+# dashboard polls instead, leaving threads for /health and the API
+MAX_LOG_STREAMS = int(os.environ.get('MAX_LOG_STREAMS', 12))
+LOG_STREAM_SLOTS = threading.BoundedSemaphore(MAX_LOG_STREAMS)
+
+# Deployment jobs go through a Redis stream read by a consumer group. A job
+# stays pending against the consumer that claimed it until the deployment
+# finishes and it is acknowledged, so a crashed worker leaves it in Redis
+# instead of losing it. The consumer running a job touches it every
+# DEPLOYMENT_HEARTBEAT_SECONDS; one left untouched for DEPLOYMENT_RECLAIM_IDLE
+# seconds belonged to a worker that died, and the next claim takes it over.
+DEPLOYMENT_STREAM = 'deployment_stream'
+DEPLOYMENT_GROUP = 'deployment_workers'
+DEPLOYMENT_CONSUMER = f'{socket.gethostname()}-{os.getpid()}'
+DEPLOYMENT_HEARTBEAT_SECONDS = 60
+DEPLOYMENT_RECLAIM_IDLE = 30 * 60
+# How often a consumer looks for abandoned jobs before reading new ones
+DEPLOYMENT_RECLAIM_INTERVAL = 60
+# A job whose deployment kills its worker this many times is dropped
+DEPLOYMENT_MAX_DELIVERIES = 3
+_DEPLOYMENT_RECLAIM = {'checked_at': 0.0}
+
+def ensure_deployment_group():
+    """Create the consumer group (and the stream) if they do not exist yet"""
+    try:
+        redis_client.xgroup_create(DEPLOYMENT_STREAM, DEPLOYMENT_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+def enqueue_deployment(job_data):
+    """Add a job to the deployment stream (never retried, see
+    redis_enqueue_client)"""
+    redis_enqueue_client.xadd(DEPLOYMENT_STREAM, {
+        'deploymentId': job_data['deploymentId'],
+        'payload': orjson.dumps(job_data)
+    })
+
+def reclaim_deployment():
+    """Take over a job abandoned by a dead consumer; returns
+    (message_id, job_data) or None"""
+    while True:
+        response = redis_client.xautoclaim(
+            DEPLOYMENT_STREAM, DEPLOYMENT_GROUP, DEPLOYMENT_CONSUMER,
+            min_idle_time=int(DEPLOYMENT_RECLAIM_IDLE * 1000), count=1
+        )
+        messages = response[1]
+        if not messages:
+            return None
+        message_id, fields = messages[0]
+        pending = redis_client.xpending_range(
+            DEPLOYMENT_STREAM, DEPLOYMENT_GROUP, min=message_id, max=message_id, count=1
+        )
+        deliveries = pending[0]['times_delivered'] if pending else 1
+        if fields and deliveries <= DEPLOYMENT_MAX_DELIVERIES:
+            logger.warning("Reclaimed deployment job %s (delivery %d)", message_id, deliveries)
+            return message_id, orjson.loads(fields['payload'])
+        logger.error("Dropping deployment job %s after %d deliveries", message_id, deliveries)
+        if fields:
+            # Nothing will run it again, so the record must not stay 'running'
+            mark_deployment_crashed(fields['deploymentId'], RuntimeError(
+                f"Deployment worker stopped {deliveries} times while running this deployment"))
+        ack_deployment(message_id)
+
+def claim_deployment(block_seconds):
+    """Claim the next job for this consumer, waiting up to block_seconds;
+    returns (message_id, job_data) or None. Abandoned jobs are taken over
+    before new ones are read."""
+    if time.monotonic() - _DEPLOYMENT_RECLAIM['checked_at'] >= DEPLOYMENT_RECLAIM_INTERVAL:
+        _DEPLOYMENT_RECLAIM['checked_at'] = time.monotonic()
+        try:
+            reclaimed = reclaim_deployment()
+        except redis.ResponseError:
+            # No group yet; the read below recreates it
+            reclaimed = None
+        if reclaimed:
+            return reclaimed
+    
+    def read():
+        return redis_client.xreadgroup(
+            DEPLOYMENT_GROUP, DEPLOYMENT_CONSUMER, {DEPLOYMENT_STREAM: '>'},
+            count=1, block=int(block_seconds * 1000)
+        )
+    try:
+        response = read()
+    except redis.ResponseError as e:
+        # The group is gone if Redis restarted without persistence
+        if 'NOGROUP' not in str(e):
+            raise
+        ensure_deployment_group()
+        response = read()
+    if not response:
+        return None
+    message_id, fields = response[0][1][0]
+    return message_id, orjson.loads(fields['payload'])
+
+def ack_deployment(message_id):
+    """Mark a claimed job as done and drop it from the stream"""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.xack(DEPLOYMENT_STREAM, DEPLOYMENT_GROUP, message_id)
+    pipe.xdel(DEPLOYMENT_STREAM, message_id)
+    pipe.execute()
+
+@contextlib.contextmanager
+def deployment_heartbeat(message_id):
+    """Keep a claimed job marked as alive while the block runs, so it is
+    not reclaimed from under a long deployment"""
+    if message_id is None:
+        yield
+        return
+    
+    stopped = threading.Event()
+    
+    def beat():
+        while not stopped.wait(DEPLOYMENT_HEARTBEAT_SECONDS):
+            try:
+                # Re-claiming with JUSTID resets the idle time without
+                # counting as a delivery
+                redis_client.xclaim(DEPLOYMENT_STREAM, DEPLOYMENT_GROUP, DEPLOYMENT_CONSUMER,
+                                    min_idle_time=0, message_ids=[message_id], justid=True)
+            except redis.RedisError:
+                logger.warning("Heartbeat for deployment job %s failed", message_id, exc_info=True)
+    
+    threading.Thread(target=beat, name=f'heartbeat-{message_id}', daemon=True).start()
+    try:
+        yield
+    finally:
+        stopped.set()
+
+if REDIS_AVAILABLE:
+    ensure_deployment_group()
+
+# Moves a deployment to a new dashboard step in one round trip: marks the
+# current step (if any, and different) completed, makes the new one current
+# and marks it active.
+# KEYS: current-step key, step-status hash
+# ARGV: new step id, completed JSON, active JSON, TTL seconds
+STEP_TRANSITION_SCRIPT = redis_client.register_script("""
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[1] then
+    redis.call('HSET', KEYS[2], current, ARGV[2])
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return current
+""") if REDIS_AVAILABLE else None
+
+# Deployment log lines are written to Redis by a single background thread, so
+# a deployment (and the Terraform output it is draining) never waits on a
+# Redis round trip per line. Lines are written in the order they were queued,
+# up to LOG_WRITE_BATCH_SIZE per pipeline; when the queue is full a line is
+# only printed.
+LOG_QUEUE_SIZE = 10000
+LOG_WRITE_BATCH_SIZE = 100
+LOG_KEY_TTL = 86400
+_LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_LOG_WRITER = {'thread': None}
+_LOG_WRITER_LOCK = threading.Lock()
+
+# STATUS log messages that move the dashboard to a step, by step ID
+STATUS_TO_STEP = MappingProxyType({
+    'ENABLING_APIS': 'enabling-apis',
+    'CLEANING_BLOCKING_RESOURCES': 'permissions',
+    'SETTING_PERMISSIONS': 'permissions',
+    'PREPARING_TERRAFORM': 'terraform-init',
+    'TERRAFORM_INIT': 'terraform-init',
+    'TERRAFORM_PLAN': 'terraform-init',
+    'IMPORTING_EXISTING': 'terraform-init',
+    'CREATING_RESOURCES': 'terraform-init',
+    'CREATING_SERVICE_ACCOUNTS': 'service-accounts',
+    'CREATING_SECRETS': 'secrets',
+    'CREATING_STORAGE': 'storage',
+    'CREATING_FIRESTORE': 'firestore',
+    'CREATING_CLOUD_FUNCTIONS': 'functions',
+    'CREATING_API_GATEWAY': 'api-gateway',
+    'CREATING_WORKLOAD_IDENTITY': 'api-gateway',
+    'RETRIEVING_OUTPUTS': 'api-gateway',
+    'DEPLOYMENT_COMPLETE': 'outputs'
+})
+
+# Step status entries have a fixed shape and a generated ISO timestamp, so
+# they are formatted directly rather than serialized
+STEP_COMPLETED_JSON = '{"status":"completed","timestamp":"%s"}'
+STEP_ACTIVE_JSON = '{"status":"active","timestamp":"%s"}'
+
+def queue_log_write(deployment_id, log_entry, step_info=None, step_id=None):
+    """Queue a log line (and any dashboard step update) for the log writer;
+    returns False if the queue is full and the line was dropped"""
+    try:
+        # Only step transitions carry a timestamp
+        _LOG_QUEUE.put_nowait((deployment_id, log_entry, step_info, step_id,
+                               datetime.utcnow() if step_id else None))
+        return True
+    except queue.Full:
+        return False
+
+def flush_log_writes(timeout=10):
+    """Wait until every line queued so far has been written (or dropped)"""
+    flushed = threading.Event()
+    try:
+        _LOG_QUEUE.put(flushed, timeout=timeout)
+    except queue.Full:
+        return False
+    return flushed.wait(timeout)
+
+def write_log_batch(batch):
+    """Write queued log lines in one pipeline, setting each key's TTL once"""
+    pipe = redis_client.pipeline(transaction=False)
+    expiring = set()
+    for deployment_id, log_entry, step_info, step_id, queued_at in batch:
+        log_key = deployment_log_key(deployment_id)
+        pipe.xadd(log_key, {'m': log_entry}, maxlen=LOG_MAX_ENTRIES, approximate=True)
+        expiring.add(log_key)
+        
+        # Store step information separately if provided
+        if step_info:
+            steps_key = f'deployment_steps:{deployment_id}'
+            pipe.hset(steps_key, step_info['id'], orjson.dumps(step_info))
+            expiring.add(steps_key)
+        
+        # Complete the previous step and activate this one server-side
+        if step_id:
+            status_key = f'deployment_step_status:{deployment_id}'
+            timestamp = queued_at.isoformat()
+            STEP_TRANSITION_SCRIPT(
+                keys=[f'deployment_current_step:{deployment_id}', status_key],
+                args=[step_id,
+                      STEP_COMPLETED_JSON % timestamp,
+                      STEP_ACTIVE_JSON % timestamp,
+                      LOG_KEY_TTL],
+                client=pipe
+            )
+            expiring.add(status_key)
+    for key in expiring:
+        pipe.expire(key, LOG_KEY_TTL)
+    pipe.execute()
+
+def log_writer():
+    """Drain the log queue for the life of the process"""
+    while True:
+        batch = []
+        flushes = []
+        item = _LOG_QUEUE.get()
+        while True:
+            if isinstance(item, threading.Event):
+                flushes.append(item)
+            else:
+                batch.append(item)
+            if len(batch) >= LOG_WRITE_BATCH_SIZE:
+                break
+            try:
+                item = _LOG_QUEUE.get_nowait()
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                write_log_batch(batch)
+            except Exception:
+                # The lines were already printed by log(); keep the writer alive
+                logger.warning("Failed to write %d log lines", len(batch), exc_info=True)
+        for flushed in flushes:
+            flushed.set()
+
+def ensure_log_writer():
+    """Start the log writer thread in this process if it is not running"""
+    with _LOG_WRITER_LOCK:
+        thread = _LOG_WRITER['thread']
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=log_writer, name='log-writer', daemon=True)
+            thread.start()
+            _LOG_WRITER['thread'] = thread
 
 if not REDIS_AVAILABLE:
     print(f"WARNING: Redis not available at {REDIS_HOST}:{REDIS_PORT}")
@@ -79,6 +595,17 @@ else:
 # Firestore for deployment records
 db = firestore.Client()
 
+def warm_firestore():
+    """Open the Firestore channel ahead of the first deployment write"""
+    try:
+        list(db.collection('deployments').limit(1).stream(timeout=10))
+    except Exception:
+        logger.warning("Firestore warm-up read failed", exc_info=True)
+
+# The client connects lazily, so without this the first deployment after a
+# cold start pays for channel setup on its 'running' update
+API_EXECUTOR.submit(warm_firestore)
+
 # OAuth2 configuration
 oauth_config = {
     "web": {
@@ -90,6 +617,90 @@ oauth_config = {
     }
 }
 
+# How long a /login redirect may take to come back to /callback
+OAUTH_STATE_TTL = 600
+
+def oauth_state_key(state):
+    """Redis key for an issued OAuth state; the raw value is never stored"""
+    return f"oauth_state:{hashlib.sha256(state.encode('utf-8')).hexdigest()}"
+
+def store_oauth_state(state):
+    """Bind an issued OAuth state to this browser's session and register it
+    in Redis so it can only be redeemed once"""
+    session['state'] = state
+    if REDIS_AVAILABLE and redis_client:
+        try:
+            redis_client.setex(oauth_state_key(state), OAUTH_STATE_TTL, '1')
+        except redis.RedisError:
+            logger.warning("Failed to store OAuth state in Redis", exc_info=True)
+
+def consume_oauth_state(state):
+    """Check that state was issued by /login to this browser and invalidate
+    it (single use)"""
+    expected = session.pop('state', None)
+    if not state or not expected or not hmac.compare_digest(expected, state):
+        return False
+    if REDIS_AVAILABLE and redis_client:
+        try:
+            return bool(redis_client.delete(oauth_state_key(state)))
+        except redis.RedisError:
+            # The session match above still ties the state to this browser
+            logger.warning("Failed to check OAuth state in Redis", exc_info=True)
+    return True
+
+# Access tokens are reused across deployments for the same refresh token
+# until they are within this many seconds of expiring. They are bearer
+# credentials, so they stay in this process's memory rather than in Redis.
+OAUTH_TOKEN_EXPIRY_MARGIN = 60
+_OAUTH_TOKENS = {}
+_OAUTH_TOKENS_LOCK = threading.Lock()
+
+def oauth_token_key(refresh_token):
+    """Cache key for an access token; the refresh token itself is not kept"""
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+# Only the user's part of the OAuth credentials travels with a queued job.
+# The client ID, secret and token URI are this service's own, and the access
+# token is replaced before use, so none of them is copied into Redis.
+JOB_CREDENTIAL_FIELDS = ('refresh_token', 'scopes')
+
+def job_credentials(credentials):
+    """The part of session credentials that is queued with a job"""
+    return {field: credentials.get(field) for field in JOB_CREDENTIAL_FIELDS}
+
+def credentials_for_job(cred_data):
+    """Rebuild full OAuth credentials from a job's credentials. Jobs queued
+    with the complete session credentials still work."""
+    return google.oauth2.credentials.Credentials(**{
+        'token': None,
+        'token_uri': oauth_config['web']['token_uri'],
+        'client_id': CLIENT_ID,
+        'client_secret': CLIENT_SECRET,
+        **cred_data
+    })
+
+def refresh_access_token(credentials):
+    """Give credentials a valid access token, reusing one cached for the same
+    refresh token when possible. Returns True if the token endpoint was
+    called."""
+    key = oauth_token_key(credentials.refresh_token)
+    with _OAUTH_TOKENS_LOCK:
+        cached = _OAUTH_TOKENS.get(key)
+    if cached and cached[1] - datetime.utcnow() > timedelta(seconds=OAUTH_TOKEN_EXPIRY_MARGIN):
+        credentials.token, credentials.expiry = cached
+        return False
+    
+    credentials.refresh(google.auth.transport.requests.Request(session=GOOGLE_API_SESSION))
+    
+    with _OAUTH_TOKENS_LOCK:
+        # Drop tokens that have expired so the cache does not grow with
+        # every user the process has ever served
+        now = datetime.utcnow()
+        for stale in [k for k, (_, expiry) in _OAUTH_TOKENS.items() if expiry <= now]:
+            del _OAUTH_TOKENS[stale]
+        _OAUTH_TOKENS[key] = (credentials.token, credentials.expiry)
+    return True
+
 @app.route('/')
 def index():
     return render_template('index.html', client_id=CLIENT_ID)
@@ -99,14 +710,25 @@ def health():
     redis_status = 'unavailable'
     queue_length = -1
     
-    if REDIS_AVAILABLE and redis_client:
-        try:
-            redis_client.ping()
-            redis_status = 'connected'
-            queue_length = redis_client.llen('deployment_queue')
-        except Exception as e:
-            redis_status = f'error: {str(e)}'
-            queue_length = -1
+    if REDIS_AVAILABLE and redis_health_client:
+        with _HEALTH_LOCK:
+            if time.monotonic() - _HEALTH_CACHE['checked_at'] >= HEALTH_CACHE_SECONDS:
+                try:
+                    # One round trip for both checks
+                    pipe = redis_health_client.pipeline(transaction=False)
+                    pipe.ping()
+                    # Jobs not yet finished: acknowledged entries are deleted
+                    pipe.xlen(DEPLOYMENT_STREAM)
+                    _, queue_length = pipe.execute()
+                    redis_status = 'connected'
+                except Exception as e:
+                    redis_status = f'error: {str(e)}'
+                    queue_length = -1
+                _HEALTH_CACHE.update(checked_at=time.monotonic(),
+                                     redis_status=redis_status,
+                                     queue_length=queue_length)
+            redis_status = _HEALTH_CACHE['redis_status']
+            queue_length = _HEALTH_CACHE['queue_length']
     
     return jsonify({
         'status': 'healthy',
@@ -156,9 +778,42 @@ def login():
         prompt='consent'
     )
     
-    session['state'] = state
+    store_oauth_state(state)
     return redirect(authorization_url)
 
+# Google's ID-token signing certificates. They rotate on a schedule announced
+# through Cache-Control, so they are fetched once per max-age rather than on
+# every login.
+GOOGLE_OAUTH2_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+_GOOGLE_CERTS = {'certs': None, 'expires_at': 0.0}
+_GOOGLE_CERTS_LOCK = threading.Lock()
+
+def google_oauth2_certs(force_refresh=False):
+    """Return Google's current {key id: certificate} map, cached per max-age"""
+    with _GOOGLE_CERTS_LOCK:
+        if force_refresh or _GOOGLE_CERTS['certs'] is None or time.monotonic() >= _GOOGLE_CERTS['expires_at']:
+            response = GOOGLE_API_SESSION.get(GOOGLE_OAUTH2_CERTS_URL, timeout=GOOGLE_API_TIMEOUT)
+            response.raise_for_status()
+            max_age = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+            _GOOGLE_CERTS['certs'] = response.json()
+            _GOOGLE_CERTS['expires_at'] = time.monotonic() + (int(max_age.group(1)) if max_age else 3600)
+        return _GOOGLE_CERTS['certs']
+
+def verify_google_id_token(token):
+    """id_token.verify_oauth2_token against the cached certificates"""
+    try:
+        id_info = jwt.decode(token, certs=google_oauth2_certs(), audience=CLIENT_ID, clock_skew_in_seconds=10)
+    except ValueError as e:
+        # Signed with a key newer than the cached set: refetch once
+        if 'Certificate for key id' not in str(e):
+            raise
+        id_info = jwt.decode(token, certs=google_oauth2_certs(force_refresh=True),
+                             audience=CLIENT_ID, clock_skew_in_seconds=10)
+    if id_info.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer: {id_info.get('iss')}")
+    return id_info
+
 @app.route('/callback')
 def callback():
     try:
@@ -170,12 +825,15 @@ def callback():
                 'description': request.args.get('error_description', 'No description')
             }), 400
         
-        state = session.get('state')
+        state = request.args.get('state')
         code = request.args.get('code')
         
         if not state or not code:
             return jsonify({'error': 'Invalid OAuth callback'}), 400
         
+        if not consume_oauth_state(state):
+            return jsonify({'error': 'Invalid or expired OAuth state'}), 400
+        
         flow = google_auth_oauthlib.flow.Flow.from_client_config(
             oauth_config,
             scopes=None,
@@ -190,6 +848,15 @@ def callback():
         flow.fetch_token(authorization_response=auth_response)
         
         credentials = flow.credentials
+        
+        # openid/email/profile are always requested, so the token response
+        # carries a signed id_token with the user's identity; no separate
+        # userinfo call is needed
+        if not getattr(credentials, 'id_token', None):
+            return jsonify({'error': 'OAuth response did not include an id_token'}), 400
+        
+        id_info = verify_google_id_token(credentials.id_token)
+        
         session['credentials'] = {
             'token': credentials.token,
             'refresh_token': credentials.refresh_token,
@@ -199,23 +866,6 @@ def callback():
             'scopes': credentials.scopes
         }
         
-        # Get user info
-        if hasattr(credentials, 'id_token') and credentials.id_token:
-            id_info = id_token.verify_oauth2_token(
-                credentials.id_token,
-                requests.Request(),
-                CLIENT_ID
-            )
-        else:
-            userinfo_request = requests.get(
-                'https://www.googleapis.com/oauth2/v2/userinfo',
-                headers={'Authorization': f'Bearer {credentials.token}'}
-            )
-            if userinfo_request.status_code == 200:
-                id_info = userinfo_request.json()
-            else:
-                id_info = {'email': 'user@example.com', 'name': 'User'}
-        
         session['user_info'] = {
             'email': id_info['email'],
             'name': id_info.get('name', 'User')
@@ -268,6 +918,28 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+# Discovery documents keyed by (service, version). discovery.build re-reads
+# the bundled JSON file on every call; the bytes are read once instead.
+# build_from_document fills in defaults on the document it is given, so each
+# build parses its own copy rather than sharing one across request threads.
+_DISCOVERY_DOCS = {}
+_DISCOVERY_LOCK = threading.Lock()
+
+def get_service(name, version, credentials):
+    """discovery.build, with the discovery document read once per process"""
+    key = (name, version)
+    raw = _DISCOVERY_DOCS.get(key)
+    if raw is None:
+        with _DISCOVERY_LOCK:
+            raw = _DISCOVERY_DOCS.get(key)
+            if raw is None:
+                raw = discovery_cache.get_static_doc(name, version)
+                if raw is None:
+                    # Not bundled with this client library; fetch it
+                    return discovery.build(name, version, credentials=credentials)
+                _DISCOVERY_DOCS[key] = raw
+    return discovery.build_from_document(orjson.loads(raw), credentials=credentials)
+
 @app.route('/api/projects')
 def list_projects():
     if 'credentials' not in session:
@@ -275,7 +947,7 @@ def list_projects():
     
     try:
         credentials = google.oauth2.credentials.Credentials(**session['credentials'])
-        service = discovery.build('cloudresourcemanager', 'v1', credentials=credentials)
+        service = get_service('cloudresourcemanager', 'v1', credentials)
         response = service.projects().list().execute()
         
         projects = []
@@ -292,6 +964,66 @@ def list_projects():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# APIs a deployment needs; missing ones are reported during validation
+VALIDATION_REQUIRED_APIS = [
+    'cloudfunctions.googleapis.com',
+    'cloudbuild.googleapis.com',
+    'firestore.googleapis.com',
+    'firebase.googleapis.com',
+    'apigateway.googleapis.com',
+    'servicecontrol.googleapis.com',
+    'servicemanagement.googleapis.com',
+    'secretmanager.googleapis.com',
+    'iam.googleapis.com'
+]
+
+def wait_for_service_usage_operation(operation, headers, timeout=SERVICE_USAGE_OPERATION_TIMEOUT):
+    """Poll a Service Usage long-running operation until done; None on timeout"""
+    deadline = time.monotonic() + timeout
+    delay = 1
+    while not operation.get('done'):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 10)
+        response = GOOGLE_API_SESSION.get(
+            f"https://serviceusage.googleapis.com/v1/{operation['name']}",
+            headers=headers,
+            timeout=GOOGLE_API_TIMEOUT
+        )
+        response.raise_for_status()
+        operation = response.json()
+    return operation
+
+def check_billing(credentials, project_id):
+    """Return validation issues for the project's billing setup"""
+    billing_service = get_service('cloudbilling', 'v1', credentials)
+    billing_info = billing_service.projects().getBillingInfo(
+        name=f'projects/{project_id}'
+    ).execute()
+    
+    if not billing_info.get('billingEnabled'):
+        return ['Billing is not enabled for this project']
+    return []
+
+def check_missing_apis(credentials, project_id):
+    """Return the required APIs that are not yet enabled on the project"""
+    service_usage = get_service('serviceusage', 'v1', credentials)
+    # Ask for just the required services instead of paging through
+    # every enabled one
+    required_services = service_usage.services().batchGet(
+        parent=f'projects/{project_id}',
+        names=[f'projects/{project_id}/services/{api}' for api in VALIDATION_REQUIRED_APIS]
+    ).execute()
+    
+    enabled_api_names = set()
+    for service in required_services.get('services', []):
+        if service.get('state') == 'ENABLED':
+            api_name = service['name'].split('/')[-1]
+            enabled_api_names.add(api_name)
+    
+    return [api for api in VALIDATION_REQUIRED_APIS if api not in enabled_api_names]
+
 @app.route('/api/validate-project', methods=['POST'])
 def validate_project():
     if 'credentials' not in session:
@@ -313,48 +1045,18 @@ def validate_project():
             'warnings': []
         }
         
-        # Check billing
-        billing_service = discovery.build('cloudbilling', 'v1', credentials=credentials)
-        billing_info = billing_service.projects().getBillingInfo(
-            name=f'projects/{project_id}'
-        ).execute()
+        # Billing and API checks are independent, so run them concurrently.
+        # Each check builds its own client since httplib2 is not thread-safe.
+        billing_future = API_EXECUTOR.submit(check_billing, credentials, project_id)
+        apis_future = API_EXECUTOR.submit(check_missing_apis, credentials, project_id)
         
-        if not billing_info.get('billingEnabled'):
+        billing_issues = billing_future.result()
+        if billing_issues:
             validation_results['valid'] = False
-            validation_results['issues'].append('Billing is not enabled for this project')
-        
-        # Check required APIs
-        service_usage = discovery.build('serviceusage', 'v1', credentials=credentials)
-        required_apis = [
-            'cloudfunctions.googleapis.com',
-            'cloudbuild.googleapis.com',
-            'firestore.googleapis.com',
-            'firebase.googleapis.com',
-            'apigateway.googleapis.com',
-            'servicecontrol.googleapis.com',
-            'servicemanagement.googleapis.com',
-            'secretmanager.googleapis.com',
-            'iam.googleapis.com'
-        ]
+            validation_results['issues'].extend(billing_issues)
         
         try:
-            # Get list of enabled services
-            enabled_services = service_usage.services().list(
-                parent=f'projects/{project_id}',
-                filter='state:ENABLED'
-            ).execute()
-            
-            enabled_api_names = set()
-            for service in enabled_services.get('services', []):
-                api_name = service['name'].split('/')[-1]
-                enabled_api_names.add(api_name)
-            
-            # Check which required APIs are missing
-            missing_apis = []
-            for api in required_apis:
-                if api not in enabled_api_names:
-                    missing_apis.append(api)
-            
+            missing_apis = apis_future.result()
             if missing_apis:
                 validation_results['warnings'].append({
                     'message': f'The following APIs will be enabled during deployment: {", ".join(missing_apis)}',
@@ -377,82 +1079,137 @@ def validate_project():
             'error': str(e)
         }), 200
 
+def terraform_output_logger(log, tail, prefixes=None):
+    """Build a run_streamed callback that keeps the last lines in tail (for
+    error messages) and forwards lines, optionally only those starting with
+    one of prefixes, to the deployment log"""
+    def on_line(line):
+        tail.append(line)
+        if prefixes is None or line.startswith(prefixes):
+            log(f"TERRAFORM: {line}")
+    return on_line
+
+# (epoch second, 'HH:MM:SS') of the last log timestamp; swapped as one tuple
+# so concurrent deployments always read a consistent pair
+_log_clock = (0, '00:00:00')
+
+def log_timestamp():
+    """UTC wall-clock time for log lines, formatted at most once a second"""
+    global _log_clock
+    second = int(time.time())
+    cached_second, text = _log_clock
+    if cached_second != second:
+        text = time.strftime('%H:%M:%S', time.gmtime(second))
+        _log_clock = (second, text)
+    return text
+
+def read_terraform_outputs(temp_dir, env):
+    """Root module outputs in `terraform output -json` form. The local state
+    file stores them in exactly that shape, so it is read directly; the CLI
+    is only started if the state cannot be read."""
+    try:
+        with open(os.path.join(temp_dir, 'terraform.tfstate'), 'rb') as f:
+            return orjson.loads(f.read())['outputs']
+    except (OSError, ValueError, KeyError):
+        logger.warning("Reading outputs from %s state failed, using terraform output", temp_dir, exc_info=True)
+    
+    result = subprocess.run(
+        ['terraform', 'output', '-json'],
+        cwd=temp_dir,
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=120
+    )
+    if result.returncode != 0:
+        raise Exception("Failed to get outputs")
+    return orjson.loads(result.stdout)
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst, copying instead across filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+@contextlib.contextmanager
+def terraform_workdir():
+    """Check out a terraform working directory for one deployment
+
+    Reuses an idle directory that has already been initialised when there is
+    one. Callers mark a directory initialised by adding it to
+    _INITIALIZED_TF_WORKDIRS once init succeeds; on exit those are scrubbed of
+    the deployment's state and credentials and returned to the pool, and any
+    other directory is deleted.
+    """
+    with _TF_WORKDIR_LOCK:
+        path = _IDLE_TF_WORKDIRS.pop() if _IDLE_TF_WORKDIRS else None
+    if path is None:
+        os.makedirs(TF_WORKDIR_ROOT, exist_ok=True)
+        path = tempfile.mkdtemp(dir=TF_WORKDIR_ROOT)
+    try:
+        yield path
+    finally:
+        with _TF_WORKDIR_LOCK:
+            reusable = path in _INITIALIZED_TF_WORKDIRS
+        if reusable:
+            try:
+                for name in TF_WORKDIR_JOB_FILES:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(path, name))
+            except OSError:
+                logger.warning("Failed to clean terraform workdir %s", path, exc_info=True)
+                reusable = False
+        if reusable:
+            with _TF_WORKDIR_LOCK:
+                _IDLE_TF_WORKDIRS.append(path)
+        else:
+            with _TF_WORKDIR_LOCK:
+                _INITIALIZED_TF_WORKDIRS.discard(path)
+                _TF_WORKDIR_CONFIGS.pop(path, None)
+            shutil.rmtree(path, ignore_errors=True)
+
 def run_single_deployment(job_data):
     """Process a single deployment with CLEAR logging"""
     deployment_id = job_data['deploymentId']
     
     deployment_ref = db.collection('deployments').document(deployment_id)
-    deployment_ref.update({
+    # Nothing waits on the 'running' marker, so it is written in the
+    # background while the deployment gets going
+    running_update = API_EXECUTOR.submit(deployment_ref.update, {
         'status': 'running',
-        'startedAt': datetime.utcnow()
+        'startedAt': firestore.SERVER_TIMESTAMP
     })
     
+    # Fields gathered along the way that are written together with the
+    # terminal status, so the record is committed once at the end
+    record_updates = {}
+    
+    def record_result(fields):
+        """Write the terminal status, never ahead of the 'running' marker or
+        the log lines queued before it"""
+        try:
+            running_update.result()
+        except Exception:
+            logger.warning("Failed to mark deployment %s running", deployment_id, exc_info=True)
+        if use_redis and not flush_log_writes():
+            logger.warning("Timed out flushing logs for deployment %s", deployment_id)
+        deployment_ref.update({**record_updates, **fields})
+    
+    # Fixed at import, so decided once here rather than on every log line
+    use_redis = bool(REDIS_AVAILABLE and redis_client)
+    if use_redis:
+        ensure_log_writer()
+    
     def log(message, step_info=None):
-        timestamp = datetime.utcnow().strftime('%H:%M:%S')
-        log_entry = f"{timestamp} - {message}"
-        if REDIS_AVAILABLE and redis_client:
-            try:
-                redis_client.lpush(f'deployment_logs:{deployment_id}', log_entry)
-                redis_client.expire(f'deployment_logs:{deployment_id}', 86400)
-                
-                # Store step information separately if provided
-                if step_info:
-                    redis_client.hset(f'deployment_steps:{deployment_id}', step_info['id'], json.dumps(step_info))
-                    redis_client.expire(f'deployment_steps:{deployment_id}', 86400)
-                
-                # Track step progress for STATUS messages
-                if message.startswith('STATUS:'):
-                    status = message.split('STATUS:')[1].strip()
-                    
-                    # Map status to step IDs that match the dashboard
-                    status_to_step = {
-                        'ENABLING_APIS': 'enabling-apis',
-                        'CLEANING_BLOCKING_RESOURCES': 'permissions',
-                        'SETTING_PERMISSIONS': 'permissions',
-                        'PREPARING_TERRAFORM': 'terraform-init',
-                        'TERRAFORM_INIT': 'terraform-init',
-                        'TERRAFORM_PLAN': 'terraform-init',
-                        'IMPORTING_EXISTING': 'terraform-init',
-                        'CREATING_RESOURCES': 'terraform-init',
-                        'CREATING_SERVICE_ACCOUNTS': 'service-accounts',
-                        'CREATING_SECRETS': 'secrets',
-                        'CREATING_STORAGE': 'storage',
-                        'CREATING_FIRESTORE': 'firestore',
-                        'CREATING_CLOUD_FUNCTIONS': 'functions',
-                        'CREATING_API_GATEWAY': 'api-gateway',
-                        'CREATING_WORKLOAD_IDENTITY': 'api-gateway',
-                        'RETRIEVING_OUTPUTS': 'api-gateway',
-                        'DEPLOYMENT_COMPLETE': 'outputs'
-                    }
-                    
-                    if status in status_to_step:
-                        step_id = status_to_step[status]
-                        
-                        # Get current step
-                        current = redis_client.get(f'deployment_current_step:{deployment_id}')
-                        if current and current.decode('utf-8') != step_id:
-                            prev_step = current.decode('utf-8')
-                            # Mark previous step as completed
-                            redis_client.hset(
-                                f'deployment_step_status:{deployment_id}',
-                                prev_step,
-                                json.dumps({'status': 'completed', 'timestamp': datetime.utcnow().isoformat()})
-                            )
-                        
-                        # Set new current step
-                        redis_client.set(f'deployment_current_step:{deployment_id}', step_id)
-                        redis_client.expire(f'deployment_current_step:{deployment_id}', 86400)
-                        
-                        # Mark step as active
-                        redis_client.hset(
-                            f'deployment_step_status:{deployment_id}',
-                            step_id,
-                            json.dumps({'status': 'active', 'timestamp': datetime.utcnow().isoformat()})
-                        )
-                        redis_client.expire(f'deployment_step_status:{deployment_id}', 86400)
-                        
-            except:
-                pass  # Fallback to just printing
+        log_entry = f"{log_timestamp()} - {message}"
+        if use_redis:
+            # Track step progress for STATUS messages
+            step_id = STATUS_TO_STEP.get(message[7:].strip()) if message[:7] == 'STATUS:' else None
+            
+            if not queue_log_write(deployment_id, log_entry, step_info, step_id):
+                logger.warning("Log queue full, dropped a line for deployment %s", deployment_id)
         else:
             # Use in-memory storage when Redis is unavailable
             if deployment_id not in IN_MEMORY_LOGS:
@@ -460,6 +1217,8 @@ def run_single_deployment(job_data):
             IN_MEMORY_LOGS[deployment_id].append(log_entry)
             # Keep only last 1000 logs per deployment to avoid memory issues
             if len(IN_MEMORY_LOGS[deployment_id]) > 1000:
+                dropped = len(IN_MEMORY_LOGS[deployment_id]) - 1000
+                IN_MEMORY_LOG_BASE[deployment_id] = IN_MEMORY_LOG_BASE.get(deployment_id, 0) + dropped
                 IN_MEMORY_LOGS[deployment_id] = IN_MEMORY_LOGS[deployment_id][-1000:]
         print(f"[{deployment_id}] {message}")
     
@@ -477,9 +1236,24 @@ def run_single_deployment(job_data):
         prefix = job_data['prefix']
         region = job_data['region']
         
-        # Create auth header for API calls
-        credentials = google.oauth2.credentials.Credentials(**job_data['credentials'])
-        credentials.refresh(google.auth.transport.requests.Request())
+        # Refresh once; the access token serves every REST call below and
+        # the refresh token goes into the credentials file for gcloud/Terraform
+        cred_data = job_data['credentials']
+        
+        # Ensure we have a refresh token
+        if not cred_data.get('refresh_token'):
+            raise Exception("No refresh token available. Please re-authenticate.")
+        
+        credentials = credentials_for_job(cred_data)
+        
+        try:
+            if refresh_access_token(credentials):
+                log("SUCCESS: Refreshed OAuth token")
+            else:
+                log("SUCCESS: Reusing cached OAuth token")
+        except Exception as e:
+            log(f"ERROR: Failed to refresh OAuth token: {str(e)}")
+            raise Exception("Failed to refresh OAuth token. Please re-authenticate.")
         
         # Enable Cloud Build API to fix the permission error
         required_apis = [
@@ -512,14 +1286,26 @@ def run_single_deployment(job_data):
             'secretmanager.googleapis.com'
         ]
         
-        import requests
-        import concurrent.futures
         headers = {'Authorization': f'Bearer {credentials.token}', 'Content-Type': 'application/json'}
         
+        # The permissions step needs the project number and IAM policy; both
+        # are read in the background while the APIs are being enabled
+        iam_policy_url = f'https://cloudresourcemanager.googleapis.com/v1/projects/{project_id}:getIamPolicy'
+        project_info_future = API_EXECUTOR.submit(
+            GOOGLE_API_SESSION.get,
+            f'https://cloudresourcemanager.googleapis.com/v1/projects/{project_id}',
+            headers=headers, timeout=GOOGLE_API_TIMEOUT
+        )
+        iam_policy_future = API_EXECUTOR.submit(
+            GOOGLE_API_SESSION.post, iam_policy_url, headers=headers, json={}, timeout=GOOGLE_API_TIMEOUT
+        )
+        
         def enable_api(api):
             try:
                 enable_url = f'https://serviceusage.googleapis.com/v1/projects/{project_id}/services/{api}:enable'
-                response = requests.post(enable_url, headers=headers, json={})
+                # Bounded per call, otherwise the executor's shutdown would
+                # wait on a hung request long after as_completed gave up
+                response = GOOGLE_API_SESSION.post(enable_url, headers=headers, json={}, timeout=GOOGLE_API_TIMEOUT)
                 if response.status_code in [200, 201]:
                     return f"SUCCESS: Enabled {api}"
                 elif response.status_code == 409:
@@ -527,61 +1313,115 @@ def run_single_deployment(job_data):
                 else:
                     return f"WARNING: Failed to enable {api}: {response.status_code}"
             except Exception as e:
+                logger.warning("Enabling %s on %s failed", api, project_id, exc_info=True)
                 return f"ERROR: Failed to enable {api}: {str(e)[:100]}"
         
-        log(f"INFO: Enabling {len(required_apis)} APIs in parallel...")
-        # Use concurrent.futures timeout instead of signal-based timeout
-        # which doesn't work in multi-threaded environments like gunicorn
+        def enabled_apis(apis):
+            """The subset of apis already enabled, from one services:batchGet"""
+            enabled = set()
+            for start in range(0, len(apis), SERVICE_USAGE_BATCH_GET_LIMIT):
+                response = GOOGLE_API_SESSION.get(
+                    f'https://serviceusage.googleapis.com/v1/projects/{project_id}/services:batchGet',
+                    headers=headers,
+                    params=[('names', f'projects/{project_id}/services/{api}')
+                            for api in apis[start:start + SERVICE_USAGE_BATCH_GET_LIMIT]],
+                    timeout=GOOGLE_API_TIMEOUT
+                )
+                response.raise_for_status()
+                enabled.update(service['name'].rsplit('/', 1)[-1]
+                               for service in response.json().get('services', [])
+                               if service.get('state') == 'ENABLED')
+            return enabled
+        
+        # Redeploys find most or all APIs on already; only the rest are enabled
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                futures = {executor.submit(enable_api, api): api for api in required_apis}
-                completed = 0
-                
-                # Use the timeout parameter in as_completed for thread-safe timeout
-                try:
-                    for future in concurrent.futures.as_completed(futures, timeout=30):
-                        completed += 1
-                        result = future.result()
-                        log(f"PROGRESS: API {completed}/{len(required_apis)} - {result}")
-                except concurrent.futures.TimeoutError:
-                    log("WARNING: API enablement timed out after 30 seconds")
-                    # Continue anyway - some APIs may have been enabled
-                
-                log("SUCCESS: All APIs processed")
-        except Exception as e:
-            log(f"ERROR: Failed to enable APIs: {str(e)}")
+            already_enabled = enabled_apis(required_apis)
+        except requests.RequestException:
+            logger.warning("Listing enabled APIs on %s failed", project_id, exc_info=True)
+            already_enabled = set()
+        apis_to_enable = [api for api in required_apis if api not in already_enabled]
+        completed = len(required_apis) - len(apis_to_enable)
+        if completed:
+            log(f"PROGRESS: API {completed}/{len(required_apis)} - INFO: {completed} APIs already enabled")
         
-        # Set up environment variables for gcloud commands
-        # Get credentials ready for cleanup operations
-        creds_file = '/tmp/temp_creds.json'
-        cred_data = job_data['credentials']
+        # batchEnable turns on up to 20 services per call; a batch is
+        # all-or-nothing, so a failed batch falls back to enabling its APIs
+        # one by one to find out which one is the problem
+        if apis_to_enable:
+            log(f"INFO: Enabling {len(apis_to_enable)} APIs in batches...")
+        batch_enable_url = f'https://serviceusage.googleapis.com/v1/projects/{project_id}/services:batchEnable'
         
-        # Ensure we have a refresh token
-        if not cred_data.get('refresh_token'):
-            raise Exception("No refresh token available. Please re-authenticate.")
+        def enable_batch(batch):
+            """batchEnable one batch and wait on its operation; returns the
+            status code and the finished operation (None if still running)"""
+            response = GOOGLE_API_SESSION.post(batch_enable_url, headers=headers, json={'serviceIds': batch}, timeout=GOOGLE_API_TIMEOUT)
+            if response.status_code != 200:
+                return response.status_code, None
+            return response.status_code, wait_for_service_usage_operation(response.json(), headers)
         
-        credentials = google.oauth2.credentials.Credentials(**cred_data)
+        # Batches are enabled concurrently and reported as each finishes
+        batches = [apis_to_enable[start:start + SERVICE_USAGE_BATCH_LIMIT]
+                   for start in range(0, len(apis_to_enable), SERVICE_USAGE_BATCH_LIMIT)]
+        fallback_apis = []
+        if batches:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(batches)) as executor:
+                batch_futures = {executor.submit(enable_batch, batch): batch for batch in batches}
+                for future in concurrent.futures.as_completed(batch_futures):
+                    batch = batch_futures[future]
+                    try:
+                        status_code, operation = future.result()
+                    except requests.RequestException:
+                        logger.warning("batchEnable on %s failed", project_id, exc_info=True)
+                        fallback_apis.extend(batch)
+                        continue
+                    if status_code != 200:
+                        log(f"WARNING: Batch enable failed ({status_code}), enabling {len(batch)} APIs individually")
+                        fallback_apis.extend(batch)
+                        continue
+                    
+                    completed += len(batch)
+                    if operation is None:
+                        log(f"PROGRESS: API {completed}/{len(required_apis)} - WARNING: Still enabling {len(batch)} APIs, continuing")
+                    elif 'error' in operation:
+                        completed -= len(batch)
+                        log(f"WARNING: Batch enable failed: {operation['error'].get('message', '')[:100]}")
+                        fallback_apis.extend(batch)
+                    else:
+                        log(f"PROGRESS: API {completed}/{len(required_apis)} - SUCCESS: Enabled {len(batch)} APIs")
         
-        # Always refresh to ensure valid token
-        try:
-            auth_request = google.auth.transport.requests.Request()
-            credentials.refresh(auth_request)
-            log("SUCCESS: Refreshed OAuth token")
-        except Exception as e:
-            log(f"ERROR: Failed to refresh OAuth token: {str(e)}")
-            raise Exception("Failed to refresh OAuth token. Please re-authenticate.")
+        if fallback_apis:
+            log(f"INFO: Enabling {len(fallback_apis)} APIs in parallel...")
+            # Use concurrent.futures timeout instead of signal-based timeout
+            # which doesn't work in multi-threaded environments like gunicorn
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=API_ENABLE_CONCURRENCY) as executor:
+                    futures = {executor.submit(enable_api, api): api for api in fallback_apis}
+                    
+                    # Use the timeout parameter in as_completed for thread-safe timeout
+                    try:
+                        for future in concurrent.futures.as_completed(futures, timeout=30):
+                            completed += 1
+                            result = future.result()
+                            log(f"PROGRESS: API {completed}/{len(required_apis)} - {result}")
+                    except concurrent.futures.TimeoutError:
+                        log("WARNING: API enablement timed out after 30 seconds")
+                        # Continue anyway - some APIs may have been enabled
+            except Exception as e:
+                log(f"ERROR: Failed to enable APIs: {str(e)}")
         
-        # Write credentials to file
-        with open(creds_file, 'w') as f:
-            f.write(json.dumps({
-                'type': 'authorized_user',
-                'client_id': credentials.client_id,
-                'client_secret': credentials.client_secret,
-                'refresh_token': credentials.refresh_token
-            }))
+        # One read tells which of the newly requested APIs actually came up
+        if apis_to_enable:
+            try:
+                now_enabled = enabled_apis(apis_to_enable)
+                for api in apis_to_enable:
+                    if api in now_enabled:
+                        log(f"SUCCESS: Enabled {api}")
+                    else:
+                        log(f"WARNING: {api} is not enabled yet")
+            except requests.RequestException:
+                logger.warning("Listing enabled APIs on %s failed", project_id, exc_info=True)
         
-        env = os.environ.copy()
-        env['GOOGLE_APPLICATION_CREDENTIALS'] = creds_file
+        log("SUCCESS: All APIs processed")
         
         # Step 1.5: Detect and clean existing resources that block deployment
         log("STATUS: SCANNING_EXISTING_RESOURCES")
@@ -591,77 +1431,103 @@ def run_single_deployment(job_data):
         cleaned = 0
         
         try:
-            # 1. Check for existing API Keys
-            try:
-                list_cmd = ['gcloud', 'services', 'api-keys', 'list',
-                            '--filter', f'displayName:"{prefix}*"',
-                            '--format=value(name)', f'--project={project_id}']
-                result = subprocess.run(list_cmd, capture_output=True, text=True, env=env)
-                if result.returncode == 0 and result.stdout:
-                    keys = [k for k in result.stdout.strip().split('\n') if k]
-                    if keys:
-                        existing_resources.extend([f"API Key: {k}" for k in keys])
-                        log(f"FOUND: {len(keys)} existing API keys")
-                        
-                        # Auto-clean API keys as they block new key generation
-                        for key_name in keys:
-                            log(f"CLEANING: API Key {key_name}")
-                            cmd = ['gcloud', 'services', 'api-keys', 'delete', key_name,
-                                   f'--project={project_id}', '--quiet']
-                            result = subprocess.run(cmd, capture_output=True, text=True, env=env)
-                            if result.returncode == 0:
-                                log(f"CLEANED: Removed API Key")
-                                cleaned += 1
-                            else:
-                                log(f"WARNING: Could not delete API key - may not have permission")
-            except Exception as e:
-                log(f"WARNING: API key scan failed: {str(e)[:100]}")
+            # The three scans are independent, so list everything at once and
+            # then issue all deletes together; results are logged in order
+            # from this thread once each phase finishes. Calls go straight to
+            # the REST APIs on the shared session rather than through gcloud.
+            def list_prefixed(url, field):
+                """Names of the resources at url whose display name starts with prefix"""
+                names = []
+                params = {}
+                while True:
+                    response = GOOGLE_API_SESSION.get(url, headers=headers, params=params, timeout=GOOGLE_API_TIMEOUT)
+                    if response.status_code != 200:
+                        return names
+                    data = response.json()
+                    names.extend(item['name'] for item in data.get(field, [])
+                                 if item.get('displayName', '').startswith(prefix))
+                    if not data.get('nextPageToken'):
+                        return names
+                    params['pageToken'] = data['nextPageToken']
             
-            # 2. Check for existing API Gateway
-            try:
-                list_cmd = ['gcloud', 'api-gateway', 'gateways', 'list',
-                            '--filter', f'displayName:"{prefix}*"',
-                            '--format=value(name)', f'--project={project_id}']
-                result = subprocess.run(list_cmd, capture_output=True, text=True, env=env)
-                if result.returncode == 0 and result.stdout:
-                    gateways = [g for g in result.stdout.strip().split('\n') if g]
-                    if gateways:
-                        existing_resources.extend([f"API Gateway: {g}" for g in gateways])
-                        log(f"FOUND: {len(gateways)} existing API gateways")
-                        
-                        # Auto-clean API gateways as they can cause naming conflicts
-                        for gateway in gateways:
-                            log(f"CLEANING: API Gateway {gateway}")
-                            # Extract location from gateway name
-                            parts = gateway.split('/')
-                            if len(parts) >= 4:
-                                location = parts[3]
-                                gateway_name = parts[5]
-                                cmd = ['gcloud', 'api-gateway', 'gateways', 'delete', gateway_name,
-                                       f'--location={location}', f'--project={project_id}', '--quiet']
-                                result = subprocess.run(cmd, capture_output=True, text=True, env=env)
-                                if result.returncode == 0:
-                                    log(f"CLEANED: Removed API Gateway")
-                                    cleaned += 1
-                                else:
-                                    log(f"WARNING: Could not delete API Gateway")
-            except Exception as e:
-                log(f"WARNING: API Gateway scan failed: {str(e)[:100]}")
+            def delete_resource(url):
+                return GOOGLE_API_SESSION.delete(url, headers=headers, timeout=GOOGLE_API_TIMEOUT)
             
-            # 3. Check for existing Firebase web apps
-            try:
-                list_cmd = ['gcloud', 'firebase', 'apps', 'list',
-                            '--filter', f'displayName:"{prefix}*"',
-                            '--format=value(name)', f'--project={project_id}']
-                result = subprocess.run(list_cmd, capture_output=True, text=True, env=env)
-                if result.returncode == 0 and result.stdout:
-                    apps = [a for a in result.stdout.strip().split('\n') if a]
-                    if apps:
-                        existing_resources.extend([f"Firebase App: {a}" for a in apps])
-                        log(f"FOUND: {len(apps)} existing Firebase apps")
-                        # Don't auto-delete Firebase apps - they can be reused
-            except Exception as e:
-                log(f"WARNING: Firebase app scan failed: {str(e)[:100]}")
+            scans = {
+                'API key': (f'https://apikeys.googleapis.com/v2/projects/{project_id}/locations/global/keys', 'keys'),
+                'API Gateway': (f'https://apigateway.googleapis.com/v1/projects/{project_id}/locations/-/gateways', 'gateways'),
+                'Firebase app': (f'https://firebase.googleapis.com/v1beta1/projects/{project_id}/webApps', 'apps'),
+            }
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(scans)) as executor:
+                scan_futures = {
+                    kind: executor.submit(list_prefixed, url, field)
+                    for kind, (url, field) in scans.items()
+                }
+                
+                def scan_results(kind):
+                    """Names listed by one scan; failures are logged and yield nothing"""
+                    try:
+                        return scan_futures[kind].result()
+                    except Exception as e:
+                        log(f"WARNING: {kind} scan failed: {str(e)[:100]}")
+                        return []
+                
+                deletes = []
+                
+                # 1. Existing API Keys
+                keys = scan_results('API key')
+                if keys:
+                    existing_resources.extend([f"API Key: {k}" for k in keys])
+                    log(f"FOUND: {len(keys)} existing API keys")
+                    
+                    # Auto-clean API keys as they block new key generation
+                    for key_name in keys:
+                        log(f"CLEANING: API Key {key_name}")
+                        deletes.append((
+                            f'https://apikeys.googleapis.com/v2/{key_name}',
+                            "CLEANED: Removed API Key",
+                            "WARNING: Could not delete API key - may not have permission",
+                        ))
+                
+                # 2. Existing API Gateways
+                gateways = scan_results('API Gateway')
+                if gateways:
+                    existing_resources.extend([f"API Gateway: {g}" for g in gateways])
+                    log(f"FOUND: {len(gateways)} existing API gateways")
+                    
+                    # Auto-clean API gateways as they can cause naming conflicts
+                    for gateway in gateways:
+                        log(f"CLEANING: API Gateway {gateway}")
+                        deletes.append((
+                            f'https://apigateway.googleapis.com/v1/{gateway}',
+                            "CLEANED: Removed API Gateway",
+                            "WARNING: Could not delete API Gateway",
+                        ))
+                
+                # 3. Existing Firebase web apps
+                apps = scan_results('Firebase app')
+                if apps:
+                    existing_resources.extend([f"Firebase App: {a}" for a in apps])
+                    log(f"FOUND: {len(apps)} existing Firebase apps")
+                    # Don't auto-delete Firebase apps - they can be reused
+            
+            if deletes:
+                # Deletes return long-running operations; accepting the request
+                # is enough here, the propagation wait below covers the rest
+                with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(deletes), 8)) as executor:
+                    delete_futures = [executor.submit(delete_resource, url) for url, _, _ in deletes]
+                    for future, (_, success_msg, failure_msg) in zip(delete_futures, deletes):
+                        try:
+                            response = future.result()
+                        except Exception as e:
+                            log(f"WARNING: Resource delete failed: {str(e)[:100]}")
+                            continue
+                        if response.status_code == 200:
+                            log(success_msg)
+                            cleaned += 1
+                        else:
+                            log(failure_msg)
                 
             # Summary
             if existing_resources:
@@ -685,10 +1551,13 @@ def run_single_deployment(job_data):
         log("STATUS: SETTING_PERMISSIONS")
         log("ACTION: Configuring service accounts and permissions...")
         
+        # When newly granted permissions can be relied on; nothing to wait for
+        # unless the policy is changed below
+        permissions_ready_at = 0.0
+        
         # Get project number for service agents
         try:
-            project_info_url = f'https://cloudresourcemanager.googleapis.com/v1/projects/{project_id}'
-            response = requests.get(project_info_url, headers=headers)
+            response = project_info_future.result()
             if response.status_code == 200:
                 project_number = response.json().get('projectNumber')
                 log(f"INFO: Project number: {project_number}")
@@ -715,211 +1584,210 @@ def run_single_deployment(job_data):
                 }
             ]
             
-            # Get current IAM policy
-            try:
-                iam_policy_url = f'https://cloudresourcemanager.googleapis.com/v1/projects/{project_id}:getIamPolicy'
-                response = requests.post(iam_policy_url, headers=headers, json={})
+            # Also grant Cloud Build permissions
+            # For projects created after July 2024, Cloud Build uses Compute Engine SA
+            # We need to grant permissions to BOTH service accounts to be safe
+            build_service_accounts = [
+                f"{project_number}@cloudbuild.gserviceaccount.com",  # Legacy Cloud Build SA
+                f"{project_number}-compute@developer.gserviceaccount.com"  # New Compute Engine SA
+            ]
+            
+            # Add multiple roles for Cloud Build
+            build_roles = [
+                'roles/cloudfunctions.developer',
+                'roles/artifactregistry.writer',
+                'roles/storage.objectAdmin',
+                'roles/logging.logWriter',
+                'roles/iam.serviceAccountUser'  # Added to fix function deployment
+            ]
+            
+            def add_missing_bindings(policy):
+                """Add the service agent and Cloud Build grants; True if the policy changed"""
+                policy_updated = False
+                bindings = policy.setdefault('bindings', [])
                 
-                if response.status_code == 200:
-                    policy = response.json()
-                    policy_updated = False
+                # The first binding for each role and its members, indexed
+                # once so each grant is a lookup rather than a scan
+                members_by_role = {}
+                for binding in bindings:
+                    if binding['role'] not in members_by_role:
+                        members_by_role[binding['role']] = (binding, set(binding.get('members', [])))
+                
+                def grant(role, member):
+                    """Add member to role; True if it was missing"""
+                    indexed = members_by_role.get(role)
+                    if indexed is None:
+                        binding = {'role': role, 'members': [member]}
+                        bindings.append(binding)
+                        members_by_role[role] = (binding, {member})
+                        return True
+                    binding, members = indexed
+                    if member in members:
+                        return False
+                    binding.setdefault('members', []).append(member)
+                    members.add(member)
+                    return True
+                
+                # Add permissions for each service agent
+                for agent in service_agents:
+                    log(f"INFO: Granting {agent['role']} to {agent['description']}...")
+                    if grant(agent['role'], f"serviceAccount:{agent['email']}"):
+                        policy_updated = True
+                
+                for build_sa in build_service_accounts:
+                    build_member = f"serviceAccount:{build_sa}"
+                    log(f"INFO: Configuring permissions for {build_sa}")
                     
-                    # Add permissions for each service agent
-                    for agent in service_agents:
-                        log(f"INFO: Granting {agent['role']} to {agent['description']}...")
-                        
-                        # Check if binding exists
-                        binding_exists = False
-                        member = f"serviceAccount:{agent['email']}"
-                        
-                        for binding in policy.get('bindings', []):
-                            if binding['role'] == agent['role']:
-                                if member not in binding.get('members', []):
-                                    binding['members'].append(member)
-                                    policy_updated = True
-                                binding_exists = True
-                                break
-                        
-                        if not binding_exists:
-                            policy['bindings'].append({
-                                'role': agent['role'],
-                                'members': [member]
-                            })
+                    for build_role in build_roles:
+                        if grant(build_role, build_member):
                             policy_updated = True
+                            log(f"INFO: Granting {build_role} to {build_sa}")
+                
+                return policy_updated
+            
+            set_iam_url = f'https://cloudresourcemanager.googleapis.com/v1/projects/{project_id}:setIamPolicy'
+            
+            # Read-modify-write of the project policy. setIamPolicy is only
+            # called when a grant is actually missing, and the policy carries
+            # the etag it was read at, so a concurrent change (another
+            # deployment, the console) fails with 409 and is retried on a
+            # fresh read instead of being overwritten.
+            try:
+                for attempt in range(IAM_POLICY_ATTEMPTS):
+                    # The first read was started alongside API enablement;
+                    # the etag catches anything that changed since
+                    if attempt == 0:
+                        response = iam_policy_future.result()
+                    else:
+                        response = GOOGLE_API_SESSION.post(iam_policy_url, headers=headers, json={}, timeout=GOOGLE_API_TIMEOUT)
+                    if response.status_code != 200:
+                        log(f"WARNING: Failed to get IAM policy: {response.status_code}")
+                        break
                     
-                    # Also grant Cloud Build permissions
-                    # For projects created after July 2024, Cloud Build uses Compute Engine SA
-                    # We need to grant permissions to BOTH service accounts to be safe
-                    build_service_accounts = [
-                        f"{project_number}@cloudbuild.gserviceaccount.com",  # Legacy Cloud Build SA
-                        f"{project_number}-compute@developer.gserviceaccount.com"  # New Compute Engine SA
-                    ]
+                    policy = response.json()
+                    if not add_missing_bindings(policy):
+                        log("INFO: All permissions already configured")
+                        break
                     
-                    # Add multiple roles for Cloud Build
-                    build_roles = [
-                        'roles/cloudfunctions.developer',
-                        'roles/artifactregistry.writer',
-                        'roles/storage.objectAdmin',
-                        'roles/logging.logWriter',
-                        'roles/iam.serviceAccountUser'  # Added to fix function deployment
-                    ]
+                    response = GOOGLE_API_SESSION.post(set_iam_url, headers=headers, json={'policy': policy}, timeout=GOOGLE_API_TIMEOUT)
                     
-                    for build_sa in build_service_accounts:
-                        build_member = f"serviceAccount:{build_sa}"
-                        log(f"INFO: Configuring permissions for {build_sa}")
-                        
-                        for build_role in build_roles:
-                            binding_exists = False
-                            
-                            for binding in policy.get('bindings', []):
-                                if binding['role'] == build_role:
-                                    if build_member not in binding.get('members', []):
-                                        binding['members'].append(build_member)
-                                        policy_updated = True
-                                        log(f"INFO: Adding {build_role} to {build_sa}")
-                                    binding_exists = True
-                                    break
-                            
-                            if not binding_exists:
-                                policy['bindings'].append({
-                                    'role': build_role,
-                                    'members': [build_member]
-                                })
-                                policy_updated = True
-                                log(f"INFO: Granting {build_role} to {build_sa}")
+                    if response.status_code == 200:
+                        log("SUCCESS: All service permissions granted")
+                        # Propagation overlaps with Terraform setup; only the
+                        # remainder is waited out before apply
+                        permissions_ready_at = time.monotonic() + IAM_PROPAGATION_SECONDS
+                        break
                     
-                    # Update IAM policy if needed
-                    if policy_updated:
-                        set_iam_url = f'https://cloudresourcemanager.googleapis.com/v1/projects/{project_id}:setIamPolicy'
-                        response = requests.post(set_iam_url, headers=headers, json={'policy': policy})
-                        
-                        if response.status_code == 200:
-                            log("SUCCESS: All service permissions granted")
-                            # Wait for permissions to propagate
-                            log("INFO: Waiting 30 seconds for permissions to propagate...")
-                            import time
-                            time.sleep(30)
-                        else:
-                            log(f"WARNING: Failed to update permissions: {response.status_code}")
-                            if response.text:
-                                try:
-                                    error_data = response.json()
-                                    log(f"ERROR: {json.dumps(error_data, indent=2)}")
-                                except:
-                                    log(f"ERROR: {response.text[:500]}")
-                    else:
-                        log("INFO: All permissions already configured")
-                else:
-                    log(f"WARNING: Failed to get IAM policy: {response.status_code}")
+                    if response.status_code == 409 and attempt < IAM_POLICY_ATTEMPTS - 1:
+                        log("INFO: IAM policy was modified concurrently, re-reading and retrying...")
+                        continue
+                    
+                    log(f"WARNING: Failed to update permissions: {response.status_code}")
+                    if response.text:
+                        try:
+                            error_data = response.json()
+                            log(f"ERROR: {orjson.dumps(error_data, option=orjson.OPT_INDENT_2).decode()}")
+                        except ValueError:
+                            log(f"ERROR: {response.text[:500]}")
+                    break
             except Exception as e:
                 log(f"WARNING: Error setting up permissions: {str(e)[:100]}")
         else:
             log("WARNING: Could not determine project number, skipping service agent permissions")
         
-        with tempfile.TemporaryDirectory() as temp_dir:
+        with terraform_workdir() as temp_dir:
             # Step 3: Prepare Terraform
             log("STATUS: PREPARING_TERRAFORM")
             log("ACTION: Setting up Terraform configuration...")
             
-            tf_config = f"""
-terraform {{
-  required_version = ">= 1.5.0"
-}}
-
-module "anava" {{
-  source = "/terraform-cache/anava-gcp-module"
-  
-  project_id       = "{job_data['projectId']}"
-  region          = "{job_data['region']}"
-  solution_prefix = "{job_data['prefix']}"
-  storage_location = "{job_data.get('storage_location', 'US')}"
-}}
-
-output "api_gateway_url" {{
-  value = module.anava.api_gateway_url
-}}
-
-output "api_key" {{
-  value = module.anava.api_key
-  sensitive = true
-}}
-
-output "firebase_config" {{
-  value = module.anava.firebase_config
-  sensitive = true
-}}
-
-output "firebase_config_secret_name" {{
-  value = module.anava.firebase_config_secret_name
-}}
-
-output "firebase_api_key_secret_name" {{
-  value = module.anava.firebase_api_key_secret_name
-}}
-
-output "workload_identity_provider" {{
-  value = module.anava.workload_identity_provider
-}}
-
-output "vertex_ai_service_account_email" {{
-  value = module.anava.vertex_ai_service_account_email
-}}
-
-output "device_auth_function_url" {{
-  value = module.anava.device_auth_function_url
-}}
-
-output "tvm_function_url" {{
-  value = module.anava.tvm_function_url
-}}
-
-output "firebase_storage_bucket" {{
-  value = module.anava.firebase_storage_bucket
-}}
-
-output "firebase_web_app_id" {{
-  value = module.anava.firebase_web_app_id
-}}
-"""
+            tf_config = TF_CONFIG_TEMPLATE.substitute(
+                project_id=job_data['projectId'],
+                region=job_data['region'],
+                prefix=job_data['prefix'],
+                storage_location=job_data.get('storage_location', 'US')
+            ).encode('utf-8')
             
-            with open(os.path.join(temp_dir, 'main.tf'), 'w') as f:
-                f.write(tf_config)
+            # A reused directory may already hold this exact configuration
+            # (e.g. redeploying the same project)
+            config_digest = hashlib.sha256(tf_config).digest()
+            if _TF_WORKDIR_CONFIGS.get(temp_dir) != config_digest:
+                fd = os.open(os.path.join(temp_dir, 'main.tf'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                try:
+                    os.write(fd, tf_config)
+                finally:
+                    os.close(fd)
+                _TF_WORKDIR_CONFIGS[temp_dir] = config_digest
             
-            # Use existing credentials file from cleanup section
+            # Terraform and gcloud read the user's credentials from this
+            # deployment's own directory; a shared path would let concurrent
+            # deployments overwrite each other's refresh token. Both refresh
+            # access tokens themselves, so it is written once per deployment.
             creds_file = os.path.join(temp_dir, 'creds.json')
-            # Copy the credentials file to the temp directory
-            import shutil
-            shutil.copy('/tmp/temp_creds.json', creds_file)
+            fd = os.open(creds_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.write(fd, orjson.dumps({
+                    'type': 'authorized_user',
+                    'client_id': credentials.client_id,
+                    'client_secret': credentials.client_secret,
+                    'refresh_token': credentials.refresh_token
+                }))
+            finally:
+                os.close(fd)
             
-            # Environment was already set up in cleanup section
             env = os.environ.copy()
             env['GOOGLE_APPLICATION_CREDENTIALS'] = creds_file
             
-            # Create terraform plugin cache directory if it doesn't exist
-            plugin_cache_dir = '/tmp/terraform-plugins'
-            os.makedirs(plugin_cache_dir, exist_ok=True)
-            env['TF_PLUGIN_CACHE_DIR'] = plugin_cache_dir
+            # Reuse providers downloaded by earlier deployments. The temp dir has
+            # no lock file yet, so allow init to link from the cache instead of
+            # re-downloading to record checksums.
+            env['TF_PLUGIN_CACHE_DIR'] = TF_PLUGIN_CACHE_DIR
+            env['TF_PLUGIN_CACHE_MAY_BREAK_DEPENDENCY_LOCK_FILE'] = '1'
+            
+            # Applies to every apply attempt the retry handler makes without
+            # touching its command line.
+            env['TF_CLI_ARGS_apply'] = f'-parallelism={TF_PARALLELISM}'
             
             # Step 4: Initialize Terraform
             log("STATUS: TERRAFORM_INIT")
-            log("ACTION: Initializing Terraform (this takes 1-2 minutes)...")
-            print(f"[{deployment_id}] Running terraform init in {temp_dir}")
-            result = subprocess.run(
-                ['terraform', 'init'],
-                cwd=temp_dir,
-                capture_output=True,
-                text=True,
-                env=env,
-                timeout=1200  # 5 minute timeout
-            )
+            if temp_dir in _INITIALIZED_TF_WORKDIRS:
+                # Module and providers are unchanged between deployments;
+                # only main.tf's variable values differ
+                log("INFO: Reusing initialized Terraform working directory")
+            elif os.path.isfile(os.path.join(TF_TEMPLATE_DIR, '.terraform', 'modules', 'modules.json')):
+                # The template was initialised at build time against the same
+                # module source, so its .terraform directory and lock file
+                # are everything init would produce here
+                shutil.copytree(
+                    os.path.join(TF_TEMPLATE_DIR, '.terraform'),
+                    os.path.join(temp_dir, '.terraform'),
+                    symlinks=True,
+                    copy_function=link_or_copy
+                )
+                link_or_copy(os.path.join(TF_TEMPLATE_DIR, '.terraform.lock.hcl'),
+                             os.path.join(temp_dir, '.terraform.lock.hcl'))
+                with _TF_WORKDIR_LOCK:
+                    _INITIALIZED_TF_WORKDIRS.add(temp_dir)
+                log("SUCCESS: Terraform initialized from the prepared template")
+            else:
+                log("ACTION: Initializing Terraform (this takes 1-2 minutes)...")
+                print(f"[{deployment_id}] Running terraform init in {temp_dir}")
+                init_cmd = ['terraform', 'init', '-no-color', '-input=false']
+                init_output = deque(maxlen=20)
+                returncode = run_streamed(
+                    init_cmd,
+                    temp_dir,
+                    env,
+                    terraform_output_logger(log, init_output),
+                    timeout=1200  # 20 minute timeout
+                )
             
-            if result.returncode != 0:
-                print(f"[{deployment_id}] Terraform init FAILED:")
-                print(f"[{deployment_id}] STDOUT: {result.stdout}")
-                print(f"[{deployment_id}] STDERR: {result.stderr}")
-                raise Exception(f"Terraform init failed: {result.stderr}")
+                if returncode != 0:
+                    print(f"[{deployment_id}] Terraform init FAILED")
+                    raise Exception("Terraform init failed: " + '\n'.join(init_output))
             
-            log("SUCCESS: Terraform initialized")
+                with _TF_WORKDIR_LOCK:
+                    _INITIALIZED_TF_WORKDIRS.add(temp_dir)
+                log("SUCCESS: Terraform initialized")
             
             # Check for existing Firebase releases that might cause conflicts
             log("STATUS: CHECKING_FIREBASE_RELEASES")
@@ -957,46 +1825,20 @@ output "firebase_web_app_id" {{
                 log(f"WARNING: Could not check Firebase status: {str(e)[:100]}")
                 log("INFO: Continuing with deployment anyway")
             
-            # Step 5: Plan deployment
-            log("STATUS: TERRAFORM_PLAN")
-            log("ACTION: Planning infrastructure changes...")
-            try:
-                result = subprocess.run(
-                    ['terraform', 'plan', '-out=tfplan'],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True,
-                    env=env,
-                    timeout=1200  # 5 minute timeout
-                )
-            except subprocess.TimeoutExpired:
-                log("ERROR: Terraform plan timed out after 5 minutes")
-                raise Exception("Terraform plan timed out - this may indicate an authentication issue or network problem")
-            
-            if result.returncode != 0:
-                # Try refresh and plan again
-                log("INFO: Refreshing state and retrying plan...")
-                refresh_result = subprocess.run(
-                    ['terraform', 'refresh'],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True,
-                    env=env,
-                    timeout=1200  # 5 minute timeout
-                )
-                
-                # Retry plan
-                result = subprocess.run(
-                    ['terraform', 'plan', '-out=tfplan'],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True,
-                    env=env,
-                    timeout=1200  # 5 minute timeout
-                )
-                
-                if result.returncode != 0:
-                    raise Exception(f"Terraform plan failed: {result.stderr}")
+            # Step 5: Validate the configuration. apply computes its own plan,
+            # so a separate plan run would only refresh every resource twice;
+            # validate is local and catches configuration errors in seconds.
+            log("ACTION: Validating Terraform configuration...")
+            validate_output = deque(maxlen=20)
+            returncode = run_streamed(
+                ['terraform', 'validate', '-no-color'],
+                temp_dir,
+                env,
+                validate_output.append,
+                timeout=300
+            )
+            if returncode != 0:
+                raise Exception("Terraform validate failed: " + '\n'.join(validate_output))
             
             # Step 6: Apply deployment with retry and partial success
             log("STATUS: CREATING_RESOURCES")
@@ -1006,10 +1848,10 @@ output "firebase_web_app_id" {{
             # Update step to service accounts to show we're starting resource creation
             log("STATUS: CREATING_SERVICE_ACCOUNTS")
             
-            # Import retry handler
-            import sys
-            sys.path.append(os.path.dirname(__file__))
-            from terraform_retry_handler import TerraformRetryHandler
+            propagation_wait = permissions_ready_at - time.monotonic()
+            if propagation_wait > 0:
+                log(f"INFO: Waiting {propagation_wait:.0f} seconds for permissions to propagate...")
+                time.sleep(propagation_wait)
             
             retry_handler = TerraformRetryHandler(log)
             
@@ -1032,10 +1874,8 @@ output "firebase_web_app_id" {{
                         log(f"  {step}")
                     manual_steps.append(intervention)
                 
-                deployment_ref.update({
-                    'manual_interventions': manual_steps,
-                    'partialSuccess': True
-                })
+                record_updates['manual_interventions'] = manual_steps
+                record_updates['partialSuccess'] = True
             
             # If deployment failed completely, handle gracefully
             if not success and not summary['manual_interventions']:
@@ -1044,23 +1884,11 @@ output "firebase_web_app_id" {{
             # Step 7: Get outputs
             log("STATUS: RETRIEVING_OUTPUTS")
             log("ACTION: Getting deployment results...")
-            result = subprocess.run(
-                ['terraform', 'output', '-json'],
-                cwd=temp_dir,
-                capture_output=True,
-                text=True,
-                env=env,
-                timeout=120  # 1 minute timeout
-            )
-            
-            if result.returncode != 0:
-                raise Exception("Failed to get outputs")
-            
-            outputs = json.loads(result.stdout)
+            outputs = read_terraform_outputs(temp_dir, env)
             
             # Log raw outputs for debugging
             log("DEBUG: Raw Terraform outputs:")
-            log(json.dumps(outputs, indent=2))
+            log(orjson.dumps(outputs, option=orjson.OPT_INDENT_2).decode())
             
             # Extract all the outputs properly - handle both dict and string formats
             def get_output_value(outputs, key, default='Not found'):
@@ -1130,7 +1958,7 @@ output "firebase_web_app_id" {{
                     result = subprocess.run(list_cmd, capture_output=True, text=True, env=env, timeout=30)
                     
                     if result.returncode == 0 and result.stdout:
-                        api_keys = json.loads(result.stdout)
+                        api_keys = orjson.loads(result.stdout)
                         if api_keys and len(api_keys) > 0:
                             # Get the first matching key
                             api_key = api_keys[0]
@@ -1150,7 +1978,7 @@ output "firebase_web_app_id" {{
                                     desc_result = subprocess.run(describe_cmd, capture_output=True, text=True, env=env, timeout=30)
                                     
                                     if desc_result.returncode == 0 and desc_result.stdout:
-                                        key_details = json.loads(desc_result.stdout)
+                                        key_details = orjson.loads(desc_result.stdout)
                                         key_string = key_details.get('keyString', '')
                                         if key_string:
                                             output_data['apiKey'] = key_string
@@ -1174,7 +2002,7 @@ output "firebase_web_app_id" {{
                     result = subprocess.run(list_cmd, capture_output=True, text=True, env=env, timeout=30)
                     
                     if result.returncode == 0 and result.stdout:
-                        functions = json.loads(result.stdout)
+                        functions = orjson.loads(result.stdout)
                         for func in functions:
                             func_name = func.get('name', '').split('/')[-1]
                             service_config = func.get('serviceConfig', {})
@@ -1225,22 +2053,6 @@ output "firebase_web_app_id" {{
             
             log("SUCCESS: All resource links created")
             
-            if REDIS_AVAILABLE and redis_client:
-                try:
-                    redis_client.setex(
-                        f'deployment_outputs:{deployment_id}',
-                        86400,
-                        json.dumps(output_data)
-                    )
-                except:
-                    pass
-            
-            deployment_ref.update({
-                'status': 'completed',
-                'completedAt': datetime.utcnow(),
-                'outputs': output_data
-            })
-            
             log("STATUS: DEPLOYMENT_COMPLETE")
             log("SUCCESS: All resources created successfully!")
             log(f"RESULT: API Gateway URL: {output_data['apiGatewayUrl']}")
@@ -1267,20 +2079,84 @@ output "firebase_web_app_id" {{
                     log(f"RESULT: Firebase Storage Bucket: {storage_bucket}")
                     
                 log(f"RESULT: Firebase Web App ID: {fc.get('appId', 'Not found')}")
+            
+            # Written last so the summary above is in the log before the
+            # dashboard sees the terminal status and stops polling
+            record_result({
+                'status': 'completed',
+                'completedAt': firestore.SERVER_TIMESTAMP,
+                'outputs': output_data
+            })
     
+    except subprocess.TimeoutExpired as e:
+        # Terraform was killed by its watchdog, process group and all
+        log(f"ERROR: Deployment timed out: {str(e)}")
+        record_result({
+            'status': 'timed_out',
+            'error': str(e),
+            'failedAt': firestore.SERVER_TIMESTAMP
+        })
     except Exception as e:
         log(f"ERROR: Deployment failed: {str(e)}")
-        deployment_ref.update({
+        record_result({
             'status': 'failed',
             'error': str(e),
-            'failedAt': datetime.utcnow()
+            'failedAt': firestore.SERVER_TIMESTAMP
+        })
+    finally:
+        # The job is acknowledged once this returns, so its log must be in Redis
+        if use_redis and not flush_log_writes():
+            logger.warning("Timed out flushing logs for deployment %s", deployment_id)
+
+def mark_deployment_crashed(deployment_id, error):
+    """Record a deployment as failed after an exception escaped
+    run_single_deployment. It records its own failures, so this only happens
+    when recording the failure itself failed; without it the deployment
+    would stay 'running' forever."""
+    logger.error("Deployment %s crashed", deployment_id, exc_info=error)
+    try:
+        db.collection('deployments').document(deployment_id).update({
+            'status': 'failed',
+            'error': str(error),
+            'failedAt': firestore.SERVER_TIMESTAMP
         })
+    except Exception:
+        logger.exception("Failed to mark deployment %s failed", deployment_id)
+
+def submit_deployment(job_data, message_id=None):
+    """Run a deployment on DEPLOYMENT_EXECUTOR; the caller must hold a slot.
+    A job claimed from the stream is acknowledged once the deployment ends."""
+    def finished(future):
+        DEPLOYMENT_SLOTS.release()
+        
+        error = future.exception()
+        if error is not None:
+            mark_deployment_crashed(job_data['deploymentId'], error)
+        
+        if message_id is not None:
+            try:
+                ack_deployment(message_id)
+            except redis.RedisError:
+                logger.warning("Failed to acknowledge deployment job %s", message_id, exc_info=True)
+    
+    def run():
+        with deployment_heartbeat(message_id):
+            run_single_deployment(job_data)
+    
+    future = DEPLOYMENT_EXECUTOR.submit(run)
+    future.add_done_callback(finished)
+    return future
 
 @app.route('/api/deploy', methods=['POST'])
 def start_deployment():
     if 'credentials' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
+    # The deployment cannot get past its first step without a refresh token,
+    # so turn the request away before anything is recorded or queued
+    if not session['credentials'].get('refresh_token'):
+        return jsonify({'error': 'No refresh token available. Please re-authenticate.'}), 401
+    
     data = request.json
     project_id = data.get('projectId')
     region = data.get('region', 'us-central1')
@@ -1294,21 +2170,15 @@ def start_deployment():
     if not prefix or not prefix.replace('-', '').isalnum() or not prefix.islower():
         return jsonify({'error': 'Prefix must be lowercase alphanumeric with optional hyphens'}), 400
     
-    deployment_id = str(uuid.uuid4())
+    # ULIDs sort by creation time, so document IDs (and the Redis keys derived
+    # from them) come out newest-last without an extra timestamp index
+    deployment_id = str(ULID())
     
-    # Store deployment record
-    deployment_ref = db.collection('deployments').document(deployment_id)
-    deployment_ref.set({
-        'id': deployment_id,
-        'projectId': project_id,
-        'region': region,
-        'prefix': prefix,
-        'storage_location': storage_location,
-        'user': session['user_info']['email'],
-        'status': 'queued',
-        'createdAt': datetime.utcnow(),
-        'updatedAt': datetime.utcnow()
-    })
+    # Without Redis there is no queue to hold the job, so refuse up front
+    # rather than record a deployment that will never run
+    run_directly = not (REDIS_AVAILABLE and redis_client)
+    if run_directly and not DEPLOYMENT_SLOTS.acquire(blocking=False):
+        return jsonify({'error': 'Too many deployments in progress, please retry shortly'}), 503
     
     # Queue deployment job
     job_data = {
@@ -1317,35 +2187,99 @@ def start_deployment():
         'region': region,
         'prefix': prefix,
         'storage_location': storage_location,
-        'credentials': session['credentials']
+        'credentials': job_credentials(session['credentials'])
     }
     
-    if REDIS_AVAILABLE and redis_client:
-        print(f"Queueing deployment {deployment_id} for project {project_id}")
-        redis_client.lpush('deployment_queue', json.dumps(job_data))
-        print(f"Job queued, queue length: {redis_client.llen('deployment_queue')}")
-        
-        return jsonify({
-            'deploymentId': deployment_id,
+    try:
+        # Store deployment record
+        deployment_ref = db.collection('deployments').document(deployment_id)
+        deployment_ref.set({
+            'id': deployment_id,
+            'projectId': project_id,
+            'region': region,
+            'prefix': prefix,
+            'storage_location': storage_location,
+            'user': session['user_info']['email'],
             'status': 'queued',
-            'message': 'Deployment queued successfully'
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP
         })
-    else:
-        # Process deployment synchronously without Redis
-        print(f"Processing deployment {deployment_id} synchronously (Redis unavailable)")
-        import threading
-        
-        def process_async():
-            run_single_deployment(job_data)
-        
-        thread = threading.Thread(target=process_async)
-        thread.start()
         
+        if run_directly:
+            # Once submitted, the deployment releases the slot when it ends
+            print(f"Processing deployment {deployment_id} synchronously (Redis unavailable)")
+            submit_deployment(job_data)
+        else:
+            print(f"Queueing deployment {deployment_id} for project {project_id}")
+            enqueue_deployment(job_data)
+            print(f"Job queued for deployment {deployment_id}")
+    except Exception:
+        # Nothing will run to give the slot back
+        if run_directly:
+            DEPLOYMENT_SLOTS.release()
+        raise
+    
+    if run_directly:
         return jsonify({
             'deploymentId': deployment_id,
             'status': 'running',
             'message': 'Deployment started (Redis unavailable, processing directly)'
         })
+    
+    return jsonify({
+        'deploymentId': deployment_id,
+        'status': 'queued',
+        'message': 'Deployment queued successfully'
+    })
+
+# How many of the user's deployments /api/deployments returns
+DEPLOYMENT_LIST_LIMIT = 20
+
+@app.route('/api/deployments')
+def list_deployments():
+    """List the current user's most recent deployments, newest first"""
+    if 'user_info' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        # Served by the (user, createdAt desc) composite index that
+        # deploy_to_production.sh creates; only the listed fields are fetched
+        query = (db.collection('deployments')
+                 .where('user', '==', session['user_info']['email'])
+                 .order_by('createdAt', direction=firestore.Query.DESCENDING)
+                 .limit(DEPLOYMENT_LIST_LIMIT)
+                 .select(['projectId', 'region', 'prefix', 'status', 'createdAt']))
+        
+        deployments = []
+        for doc in query.stream():
+            deployment = doc.to_dict()
+            deployments.append({
+                'id': doc.id,
+                'projectId': deployment.get('projectId'),
+                'region': deployment.get('region'),
+                'prefix': deployment.get('prefix'),
+                'status': deployment.get('status'),
+                'createdAt': deployment.get('createdAt')
+            })
+        
+        return jsonify({'deployments': deployments})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def set_in_memory_logs(deployment_data, deployment_id, since=None):
+    """Fill in logs from IN_MEMORY_LOGS, honouring the ?since= cursor"""
+    logs = IN_MEMORY_LOGS[deployment_id]
+    if since is None:
+        deployment_data['logs'] = logs
+    else:
+        # Lines already trimmed away are skipped rather than re-sent
+        base = IN_MEMORY_LOG_BASE.get(deployment_id, 0)
+        start = max(int(since) - base, 0) if since.isdigit() else 0
+        page = logs[start:start + LOG_PAGE_SIZE]
+        deployment_data['logs'] = page
+        deployment_data['next_since'] = str(base + start + len(page))
+        deployment_data['more_logs'] = start + len(page) < len(logs)
 
 @app.route('/api/deployment/<deployment_id>')
 def get_deployment_status(deployment_id):
@@ -1367,45 +2301,126 @@ def get_deployment_status(deployment_id):
     if 'manual_interventions' in deployment_data:
         deployment_data['manual_interventions'] = deployment_data['manual_interventions']
     
+    # With ?since=<cursor> only entries after the cursor are returned, oldest
+    # first, along with next_since for the following poll; since=0 starts from
+    # the beginning. Without it the full log is returned newest first, as before.
+    since = request.args.get('since')
+    if since is not None and not LOG_CURSOR_RE.match(since):
+        since = '0'
+    
     if REDIS_AVAILABLE and redis_client:
         try:
-            logs = redis_client.lrange(f'deployment_logs:{deployment_id}', 0, -1)
+            # Logs and step state come back in one round trip
+            log_key = deployment_log_key(deployment_id)
+            pipe = redis_client.pipeline(transaction=False)
+            if since is None:
+                pipe.xrevrange(log_key)
+            else:
+                # XREAD without BLOCK returns what follows the given ID, a
+                # page at a time; next_since points at the rest
+                pipe.xread({log_key: since}, count=LOG_PAGE_SIZE)
+            pipe.hgetall(f'deployment_steps:{deployment_id}')
+            pipe.get(f'deployment_current_step:{deployment_id}')
+            pipe.hgetall(f'deployment_step_status:{deployment_id}')
+            response, steps, current_step, step_status = pipe.execute()
+            
+            if since is None:
+                logs = [fields['m'] for _, fields in response]
+            else:
+                entries = response[0][1] if response else []
+                logs = [fields['m'] for _, fields in entries]
+                deployment_data['next_since'] = entries[-1][0] if entries else since
+                deployment_data['more_logs'] = len(entries) == LOG_PAGE_SIZE
             deployment_data['logs'] = logs
             
             # Get step information
-            steps = redis_client.hgetall(f'deployment_steps:{deployment_id}')
             if steps:
-                deployment_data['steps'] = {k: json.loads(v) for k, v in steps.items()}
+                deployment_data['steps'] = {k: orjson.loads(v) for k, v in steps.items()}
             
             # Get current step
-            current_step = redis_client.get(f'deployment_current_step:{deployment_id}')
             if current_step:
                 deployment_data['currentStep'] = current_step
             
             # Get step status details
-            step_status = redis_client.hgetall(f'deployment_step_status:{deployment_id}')
             if step_status:
-                deployment_data['stepStatus'] = {k: json.loads(v) for k, v in step_status.items()}
+                deployment_data['stepStatus'] = {k: orjson.loads(v) for k, v in step_status.items()}
             
-            if deployment_data['status'] == 'completed':
-                outputs = redis_client.get(f'deployment_outputs:{deployment_id}')
-                if outputs:
-                    deployment_data['outputs'] = json.loads(outputs)
-        except:
+        except Exception:
+            logger.warning("Failed to read deployment %s from Redis", deployment_id, exc_info=True)
             # Use in-memory logs as fallback
             if deployment_id in IN_MEMORY_LOGS:
-                deployment_data['logs'] = IN_MEMORY_LOGS[deployment_id]
+                set_in_memory_logs(deployment_data, deployment_id, since)
             else:
                 deployment_data['logs'] = ['Redis error - using in-memory logs']
     else:
         # Use in-memory logs when Redis is unavailable
         if deployment_id in IN_MEMORY_LOGS:
-            deployment_data['logs'] = IN_MEMORY_LOGS[deployment_id]
+            set_in_memory_logs(deployment_data, deployment_id, since)
         else:
             deployment_data['logs'] = ['No logs available yet...']
     
     return jsonify(deployment_data)
 
+@app.route('/api/deployment/<deployment_id>/stream')
+def stream_deployment_logs(deployment_id):
+    """Push new deployment log entries to the browser as Server-Sent Events"""
+    if 'user_info' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if not (REDIS_AVAILABLE and redis_client):
+        return jsonify({'error': 'Log streaming unavailable'}), 503
+    
+    deployment = db.collection('deployments').document(deployment_id).get()
+    
+    if not deployment.exists:
+        return jsonify({'error': 'Deployment not found'}), 404
+    
+    if deployment.to_dict()['user'] != session['user_info']['email']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    if not LOG_STREAM_SLOTS.acquire(blocking=False):
+        return jsonify({'error': 'Too many log streams open, poll instead'}), 503
+    
+    # Events are read from the log stream itself and carry their entry IDs,
+    # so a reconnecting EventSource (which sends Last-Event-ID) or a client
+    # passing ?since=<cursor> picks up exactly where it left off. Without
+    # either, only entries added from now on are sent.
+    log_key = deployment_log_key(deployment_id)
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    if not last_id or not LOG_CURSOR_RE.match(last_id):
+        try:
+            latest = redis_client.xrevrange(log_key, count=1)
+        except Exception:
+            LOG_STREAM_SLOTS.release()
+            raise
+        last_id = latest[0][0] if latest else '0'
+    
+    def generate():
+        nonlocal last_id
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        yield 'retry: 2000\n\n'
+        while time.monotonic() < deadline:
+            response = redis_client.xread({log_key: last_id}, count=100,
+                                          block=int(SSE_KEEPALIVE_SECONDS * 1000))
+            if not response:
+                yield ': keepalive\n\n'
+                continue
+            for entry_id, fields in response[0][1]:
+                last_id = entry_id
+                # Multi-line entries need one data: field per line
+                yield (f'id: {entry_id}\n'
+                       + ''.join(f'data: {line}\n' for line in fields['m'].split('\n')) + '\n')
+    
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # The server closes the response however the stream ends, including
+    # when the client disconnects before the first event
+    response.call_on_close(LOG_STREAM_SLOTS.release)
+    return response
+
 @app.route('/api/deployment/<deployment_id>/progress')
 def get_deployment_progress(deployment_id):
     """Get real-time deployment progress"""
@@ -1443,7 +2458,7 @@ def get_deployment_progress(deployment_id):
             # Get step statuses
             step_data = redis_client.hgetall(f'deployment_step_status:{deployment_id}')
             for step_id, status in step_data.items():
-                progress['steps'][step_id] = json.loads(status)
+                progress['steps'][step_id] = orjson.loads(status)
             
             # Calculate overall progress
             total_steps = 9  # Total deployment steps
@@ -1455,6 +2470,13 @@ def get_deployment_progress(deployment_id):
     
     return jsonify(progress)
 
+# Log lines the resources view reports on: a resource created by apply, or
+# an error (counted as a failed resource when it mentions one)
+RESOURCE_LOG_RE = re.compile(
+    r'PROGRESS: Created resource\s*(?P<number>\d+):(?P<name>.*)'
+    r'|ERROR:(?P<error>(?:(?!ERROR:).)*)'
+)
+
 @app.route('/api/deployment/<deployment_id>/resources')
 def get_deployment_resources(deployment_id):
     """Get detailed resource information for a deployment"""
@@ -1484,19 +2506,18 @@ def get_deployment_resources(deployment_id):
     # Parse logs to extract resource information
     if REDIS_AVAILABLE and redis_client:
         try:
-            logs = redis_client.lrange(f'deployment_logs:{deployment_id}', 0, -1)
+            logs = [fields['m'] for _, fields in redis_client.xrange(deployment_log_key(deployment_id))]
             for log in logs:
-                if 'PROGRESS: Created resource' in log:
-                    # Extract resource info from log
-                    parts = log.split('PROGRESS: Created resource')[1].strip()
-                    if ':' in parts:
-                        num, name = parts.split(':', 1)
-                        resources['created_resources'].append({
-                            'number': int(num.strip()),
-                            'name': name.strip()
-                        })
-                elif 'ERROR:' in log and 'resource' in log.lower():
-                    resources['failed_resources'].append(log.split('ERROR:')[1].strip())
+                event = RESOURCE_LOG_RE.search(log)
+                if event is None:
+                    continue
+                if event.lastgroup == 'name':
+                    resources['created_resources'].append({
+                        'number': int(event.group('number')),
+                        'name': event.group('name').strip()
+                    })
+                elif 'resource' in log.lower():
+                    resources['failed_resources'].append(event.group('error').strip())
         except Exception as e:
             resources['error'] = f"Failed to parse logs: {str(e)}"
     
@@ -1550,8 +2571,8 @@ def get_acap_configuration(deployment_id):
     if isinstance(firebase_config, str):
         # If it's a string, it might be JSON
         try:
-            firebase_config = json.loads(firebase_config)
-        except:
+            firebase_config = orjson.loads(firebase_config)
+        except ValueError:
             firebase_config = {}
     
     acap_config = {
@@ -1585,30 +2606,28 @@ def get_acap_configuration(deployment_id):
 @app.route('/api/worker/process', methods=['POST'])
 def process_worker():
     """Manually process one job from the queue"""
+    # Leave the job in Redis until there is capacity to run it
+    if not DEPLOYMENT_SLOTS.acquire(blocking=False):
+        return jsonify({'status': 'busy', 'message': 'All deployment slots in use'})
+    
     try:
         # Check queue
-        job_json = redis_client.brpop('deployment_queue', timeout=1)
-        if not job_json:
+        claimed = claim_deployment(block_seconds=1)
+        if not claimed:
+            DEPLOYMENT_SLOTS.release()
             return jsonify({'status': 'no_jobs', 'message': 'No jobs in queue'})
         
         # Process the job
-        import threading
-        job_data = json.loads(job_json[1])
-        
-        def process_job():
-            deployment_id = job_data['deploymentId']
-            print(f"Processing deployment {deployment_id}")
-            # Run the deployment logic
-            run_single_deployment(job_data)
-        
-        thread = threading.Thread(target=process_job)
-        thread.start()
+        message_id, job_data = claimed
+        print(f"Processing deployment {job_data['deploymentId']}")
+        submit_deployment(job_data, message_id)
         
         return jsonify({
             'status': 'processing',
             'deployment_id': job_data['deploymentId']
         })
     except Exception as e:
+        DEPLOYMENT_SLOTS.release()
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 if __name__ == '__main__':
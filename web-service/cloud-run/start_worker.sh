@@ -1,5 +1,11 @@
 #!/bin/bash
 
+# "worker" runs only the standalone queue workers (WORKER_CONCURRENCY
+# processes reading the Redis stream), with no web server to poll
+if [ "$1" = "worker" ]; then
+    exec python worker.py
+fi
+
 # Start a background loop that triggers the worker every 5 seconds
 while true; do
     # Try to process a job
@@ -3,14 +3,183 @@
 Terraform retry handler for partial deployments
 """
 
+import os
 import re
 import time
+import fcntl
+import signal
+import threading
 import subprocess
-from typing import List, Dict, Tuple
+from collections import deque
+from typing import Callable, List, Dict, Optional, Tuple
+
+# Kernel buffer requested for a Terraform pipe (Linux defaults to 64 KiB), and
+# the most read from it per syscall. A chatty apply then fills one large read
+# instead of waking the reader for every 64 KiB.
+PIPE_BUFFER_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = PIPE_BUFFER_SIZE
+
+# Output the pipe reader may get ahead of the line callback before it waits
+OUTPUT_BUFFER_LIMIT = 16 * 1024 * 1024
+
+# Seconds a timed-out process group gets to exit after SIGTERM before SIGKILL
+KILL_GRACE_PERIOD = 30
+
+
+def terminate_process_group(process: subprocess.Popen, grace_period: float = KILL_GRACE_PERIOD):
+    """SIGTERM a process started with start_new_session=True and everything it
+    spawned (Terraform provider plugins), escalating to SIGKILL if the group
+    has not exited after grace_period seconds."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    except ProcessLookupError:
+        pass
+
+
+def run_streamed(cmd: List[str], cwd: str, env: dict, on_line: Callable[[str], None],
+                 timeout: Optional[float] = None) -> int:
+    """Run a command and hand each non-empty output line to on_line as it arrives.
+
+    stdout and stderr are merged and read as raw bytes in fixed-size chunks,
+    decoding once per chunk, so memory stays flat however much the command
+    prints. Returns the exit code; raises subprocess.TimeoutExpired if the
+    command is still running after timeout seconds.
+
+    A reader thread drains the pipe into a buffer while the calling thread
+    runs on_line, so a slow callback (a Redis write per log line) never
+    leaves the command blocked on a full pipe. The deadline is enforced while
+    waiting on the buffer, so it holds even while the command is silent or
+    mid-line.
+    The command runs in its own session so that on timeout the whole process
+    group is terminated, not just the top-level binary - otherwise provider
+    plugins keep the pipe open and the read never finishes.
+    """
+    process = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=0,
+        env=env,
+        start_new_session=True
+    )
+
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    # Bytes read but not yet handed to on_line. The reader appends and the
+    # caller swaps out everything buffered at once, so a slow callback gets
+    # larger batches rather than holding up the pipe.
+    state = {'eof': False, 'buffered': bytearray()}
+    ready = threading.Condition()
+    stopped = threading.Event()
+
+    fd = process.stdout.fileno()
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+    except (AttributeError, OSError):
+        # Not Linux, or above the pipe-max-size limit: keep the default
+        pass
+
+    def read_output():
+        # The reader owns the pipe and is the only thread that closes it
+        try:
+            while not stopped.is_set():
+                chunk = os.read(fd, READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                with ready:
+                    while len(state['buffered']) >= OUTPUT_BUFFER_LIMIT and not stopped.is_set():
+                        ready.wait(1)
+                    state['buffered'] += chunk
+                    ready.notify_all()
+        except OSError:
+            pass
+        finally:
+            process.stdout.close()
+            with ready:
+                state['eof'] = True
+                ready.notify_all()
+
+    threading.Thread(target=read_output, name=f'{cmd[0]}-output', daemon=True).start()
+
+    # Trailing partial line, kept until its newline arrives
+    pending = bytearray()
+    try:
+        while True:
+            wait = remaining()
+            if wait == 0:
+                terminate_process_group(process)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            with ready:
+                if not state['buffered'] and not state['eof']:
+                    ready.wait(wait)
+                data, state['buffered'] = state['buffered'], bytearray()
+                eof = state['eof']
+                ready.notify_all()
+            if data:
+                pending += data
+                end = pending.rfind(b'\n')
+                if end != -1:
+                    # Only whole lines are decoded
+                    complete = pending[:end]
+                    del pending[:end + 1]
+                    for line in complete.decode('utf-8', 'replace').split('\n'):
+                        line = line.strip()
+                        if line:
+                            on_line(line)
+            if eof:
+                break
+
+        line = pending.decode('utf-8', 'replace').strip()
+        if line:
+            on_line(line)
+
+        # The pipe can close before the process exits
+        try:
+            return process.wait(timeout=remaining())
+        except subprocess.TimeoutExpired:
+            terminate_process_group(process)
+            raise subprocess.TimeoutExpired(cmd, timeout)
+    finally:
+        stopped.set()
+        # on_line raised: don't leave the command running unattended
+        if process.poll() is None:
+            terminate_process_group(process)
+
 
 class TerraformRetryHandler:
     """Handle Terraform errors with retry logic and manual intervention tracking"""
     
+    # Apply output that carries no progress information (state refreshes and
+    # data source reads, usually prefixed with the resource address). Matched
+    # once per line so these are dropped before any classification work.
+    NOISE_RE = re.compile(r'^(?:\S+: )?(?:Refreshing state|Reading\.\.\.|Still reading|Read complete)')
+    
+    # Apply events worth reporting, found with a single scan per line. On
+    # progress lines the resource address is whatever precedes the match.
+    APPLY_EVENT_RE = re.compile(
+        r'(?P<created>Creation complete|Created)'
+        r'|(?P<creating>Creating\.\.\.)'
+        r'|(?P<waiting>Still creating\.\.\. \[(?P<elapsed>[^\]]*?)s elapsed\])'
+        r'|(?P<error>Error:)'
+    )
+    
+    # Hard ceiling for a single terraform apply attempt, in seconds
+    APPLY_TIMEOUT = int(os.environ.get('TERRAFORM_APPLY_TIMEOUT', 1800))
+    
+    # Apply output kept for error parsing. Terraform prints its error blocks
+    # after all progress output, so the tail is all that is ever needed.
+    OUTPUT_TAIL_LINES = 2000
+    
     # Errors that can be retried
     RETRYABLE_ERRORS = [
         "Error waiting for Creating",
@@ -32,6 +201,9 @@ class TerraformRetryHandler:
         "already own it",  # Storage buckets
     ]
     
+    # Lowercased once for the case-insensitive check on parsed error blocks
+    IGNORABLE_ERRORS_LOWER = tuple(pattern.lower() for pattern in IGNORABLE_ERRORS)
+    
     # Errors that need manual intervention
     MANUAL_INTERVENTION_ERRORS = {
         "You must verify site or domain ownership": {
@@ -81,7 +253,8 @@ class TerraformRetryHandler:
             error_msg = block[0]
             
             # Check if it's ignorable (treat as success)
-            is_ignorable = any(pattern.lower() in error_msg.lower() for pattern in self.IGNORABLE_ERRORS)
+            error_lower = error_msg.lower()
+            is_ignorable = any(pattern in error_lower for pattern in self.IGNORABLE_ERRORS_LOWER)
             if is_ignorable:
                 self.log(f"INFO: Ignoring error (resource already exists): {error_msg}")
                 continue  # Skip this error entirely
@@ -127,83 +300,75 @@ class TerraformRetryHandler:
             if attempt > 0:
                 self.log(f"INFO: Retry attempt {attempt + 1} of {max_retries}")
                 time.sleep(10 * attempt)  # Exponential backoff
-                
-                # Re-plan before retry to avoid stale plan
-                self.log("INFO: Re-planning before retry...")
-                plan_result = subprocess.run(
-                    ['terraform', 'plan', '-out=tfplan', '-no-color'],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True,
-                    env=env
-                )
-                if plan_result.returncode != 0:
-                    self.log(f"ERROR: Re-plan failed: {plan_result.stderr}")
-                    return False, "Failed to re-plan for retry"
             
             # Run terraform apply with real-time output processing
-            process = subprocess.Popen(
-                ['terraform', 'apply', '-auto-approve', '-no-color', 'tfplan'],
-                cwd=temp_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                env=env
-            )
-            
-            output_lines = []
+            output_lines = deque(maxlen=self.OUTPUT_TAIL_LINES)
             resources_created = 0
-            current_step = None
             
-            for line in process.stdout:
-                line = line.strip()
-                if line:
-                    output_lines.append(line)
+            noise_match = self.NOISE_RE.match
+            event_search = self.APPLY_EVENT_RE.search
+            
+            def handle_line(line):
+                nonlocal resources_created
+                if noise_match(line):
+                    return
+                output_lines.append(line)
+                
+                event = event_search(line)
+                if event is None:
+                    return
+                kind = event.lastgroup
+                
+                # Track progress
+                if kind == 'created':
+                    resources_created += 1
+                    
+                    # The address is whatever precedes the match, e.g.
+                    # "module.anava.google_service_account.device_auth: Creation complete"
+                    full_path = line[:event.start()].rstrip(': ')
+                    resource_name = full_path.replace('module.anava.', '') if full_path else 'unknown'
                     
-                    # Track progress
-                    if 'Creation complete' in line or 'Created' in line:
-                        resources_created += 1
-                        resource_name = 'unknown'
-                        
-                        # Better resource name extraction
-                        # Example: "module.anava.google_service_account.device_auth: Creation complete"
-                        if ': Creation complete' in line or ': Created' in line:
-                            full_resource = line.split(':')[0].strip()
-                            # Get the full resource path
-                            resource_name = full_resource
-                            # Also extract just the resource type and name
-                            if 'module.anava.' in full_resource:
-                                resource_name = full_resource.replace('module.anava.', '')
-                        
-                        self.log(f"PROGRESS: Created resource {resources_created}: {resource_name}")
-                        self.successful_resources.append({
-                            'number': resources_created,
-                            'name': resource_name,
-                            'full_path': line.split(':')[0].strip() if ':' in line else resource_name
-                        })
-                        
-                    elif 'Creating...' in line:
-                        resource_name = line.split('.')[-1].split(':')[0] if '.' in line else 'resource'
-                        self.log(f"INFO: Creating {resource_name}...")
-                        
-                    elif 'Still creating' in line:
-                        # Extract wait time
-                        if '[' in line and 's elapsed]' in line:
-                            elapsed = line.split('[')[1].split('s elapsed]')[0]
-                            resource = line.split('...')[0].strip()
-                            self.log(f"WAITING: {resource} ({elapsed}s elapsed)")
+                    self.log(f"PROGRESS: Created resource {resources_created}: {resource_name}")
+                    self.successful_resources.append({
+                        'number': resources_created,
+                        'name': resource_name,
+                        'full_path': full_path or resource_name
+                    })
                     
-                    elif 'Error:' in line:
-                        # Check if it's an ignorable error
-                        if any(pattern in line for pattern in self.IGNORABLE_ERRORS):
-                            self.log(f"INFO: Ignoring error (already exists): {line}")
-                        else:
-                            self.log(f"ERROR: {line}")
-            
-            process.wait()
+                elif kind == 'creating':
+                    resource_name = line[:event.start()].rstrip(': ').replace('module.anava.', '') or 'resource'
+                    self.log(f"INFO: Creating {resource_name}...")
+                    
+                elif kind == 'waiting':
+                    resource = line[:event.start()].rstrip(': ')
+                    self.log(f"WAITING: {resource} ({event.group('elapsed')}s elapsed)")
+                
+                else:
+                    # Check if it's an ignorable error
+                    if any(pattern in line for pattern in self.IGNORABLE_ERRORS):
+                        self.log(f"INFO: Ignoring error (already exists): {line}")
+                    else:
+                        self.log(f"ERROR: {line}")
+            
+            # A hung provider must not hold the worker forever; TimeoutExpired
+            # propagates so the caller can mark the deployment timed out
+            try:
+                # No saved plan: apply plans against current state on every
+                # attempt, so a retry never runs a stale plan
+                returncode = run_streamed(
+                    ['terraform', 'apply', '-auto-approve', '-no-color', '-input=false'],
+                    temp_dir,
+                    env,
+                    handle_line,
+                    timeout=self.APPLY_TIMEOUT
+                )
+            except subprocess.TimeoutExpired:
+                self.log(f"ERROR: Terraform apply exceeded {self.APPLY_TIMEOUT}s and was terminated")
+                raise
+            
             output = '\n'.join(output_lines)
             
-            if process.returncode == 0:
+            if returncode == 0:
                 self.log("SUCCESS: Terraform apply completed successfully")
                 return True, output
             
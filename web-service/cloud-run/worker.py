@@ -3,43 +3,65 @@
 Worker process that imports deployment logic from main.py
 """
 
-from main import run_single_deployment
+# Job tracking shares main's Redis pool with the log writes the deployment
+# makes, so the worker holds one pooled connection for the blocking read
+# instead of a separate client of its own
+from main import (run_single_deployment, redis_client, claim_deployment, ack_deployment,
+                  deployment_heartbeat, mark_deployment_crashed)
 import os
-import json
-import redis
-from google.cloud import firestore
-from datetime import datetime
+import multiprocessing
 
-# Redis for job tracking
-redis_client = redis.StrictRedis(
-    host=os.environ.get('REDIS_HOST', 'localhost'),
-    port=int(os.environ.get('REDIS_PORT', 6379)),
-    decode_responses=True
-)
+# Deployments are rare, so block on the queue for a long time; short blocking
+# timeouts make Redis wake up and expire idle waiters over and over
+QUEUE_BLOCK_TIMEOUT = 30
 
-# Firestore for deployment records
-db = firestore.Client()
+# Worker processes pulling from the queue; the consumer group hands each job
+# to exactly one
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4))
 
 def run_deployment_worker():
     """Background worker process"""
+    if redis_client is None:
+        print("Worker error: Redis is not available, no queue to read from")
+        return
+    
     print("Deployment worker started and waiting for jobs...")
     
     while True:
         try:
             # Wait for job
-            job_json = redis_client.brpop('deployment_queue', timeout=5)
-            if not job_json:
+            claimed = claim_deployment(block_seconds=QUEUE_BLOCK_TIMEOUT)
+            if not claimed:
                 continue
             
-            print(f"Got deployment job: {job_json[0]}")
-            job_data = json.loads(job_json[1])
+            message_id, job_data = claimed
+            print(f"[{multiprocessing.current_process().name}] Got deployment job: {message_id}")
             
-            # Run the deployment using the function from main.py
-            run_single_deployment(job_data)
+            # Run the deployment using the function from main.py; it records
+            # its own failures, so the job is acknowledged either way
+            try:
+                with deployment_heartbeat(message_id):
+                    run_single_deployment(job_data)
+            except Exception as e:
+                mark_deployment_crashed(job_data['deploymentId'], e)
+            finally:
+                ack_deployment(message_id)
             
         except Exception as e:
             print(f"Worker error: {e}")
             continue
 
 if __name__ == '__main__':
-    run_deployment_worker()
\ No newline at end of file
+    if WORKER_CONCURRENCY <= 1:
+        run_deployment_worker()
+    else:
+        # Spawn rather than fork: each child imports main afresh and so builds
+        # its own Redis pool and Firestore client, neither of which survives
+        # a fork once connected
+        ctx = multiprocessing.get_context('spawn')
+        workers = [ctx.Process(target=run_deployment_worker, name=f'worker-{i}')
+                   for i in range(WORKER_CONCURRENCY)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
\ No newline at end of file